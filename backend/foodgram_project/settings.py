@@ -98,9 +98,63 @@ DATABASES = {
     }
 }
 
+# Кеш. общий для всех воркеров и manage.py бэкенд задается через CACHE_URL,
+# например pymemcache://memcached:11211 (infra/docker-compose.yml) или
+# dbcache://foodgram_cache после manage.py createcachetable.
+# locmemcache:// по умолчанию - только для разработки и тестов: сбросы
+# кешей в памяти процессов не доходят до других процессов.
+# django-environ 0.7 сопоставляет pymemcache:// с PyLibMCCache
+
+environ.Env.CACHE_SCHEMES['pymemcache'] = (
+    'django.core.cache.backends.memcached.PyMemcacheCache'
+)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Бэкенды, кеш которых не виден другим процессам
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Сколько секунд справочники (теги, ингредиенты, индекс поиска) живут
+# в памяти процесса, даже если сброс версии не дошел
+
+REFERENCE_CACHE_TIMEOUT = env.int('REFERENCE_CACHE_TIMEOUT', default=300)
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
+AUTHENTICATION_BACKENDS = ['users.backends.PooledModelBackend']
+
+# Первый хешер - для новых паролей, хеши остальных пересчитываются
+# им при входе. для argon2 нужен пакет argon2-cffi:
+# PASSWORD_HASHERS=users.hashers.Argon2PasswordHasher,users.hashers.PBKDF2PasswordHasher
+
+PASSWORD_HASHERS = env.list('PASSWORD_HASHERS', default=[
+    'users.hashers.PBKDF2PasswordHasher',
+    'users.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+])
+PASSWORD_PBKDF2_ITERATIONS = env.int(
+    'PASSWORD_PBKDF2_ITERATIONS', default=260_000
+)
+PASSWORD_ARGON2_TIME_COST = env.int('PASSWORD_ARGON2_TIME_COST', default=2)
+PASSWORD_ARGON2_MEMORY_COST = env.int(
+    'PASSWORD_ARGON2_MEMORY_COST', default=102_400
+)
+PASSWORD_ARGON2_PARALLELISM = env.int(
+    'PASSWORD_ARGON2_PARALLELISM', default=8
+)
+
+# Проверка паролей при входе: потоки пула и сколько входов может ждать,
+# остальные получают 429. 0 потоков - проверять в потоке запроса
+
+LOGIN_WORKERS = env.int('LOGIN_WORKERS', default=2)
+LOGIN_QUEUE_SIZE = env.int('LOGIN_QUEUE_SIZE', default=8)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -151,7 +205,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_FILTER_BACKENDS': [
@@ -175,3 +229,81 @@ DJOSER = {
     'HIDE_USERS': False,
     'USER_ID_FIELD': 'id',
 }
+
+# Шрифт с кириллицей для выгрузки списка покупок в PDF
+
+SHOPPING_CART_PDF_FONT = env(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Сколько позиций списка покупок попадает в PDF: reportlab держит все
+# страницы в памяти до конца файла. полный список - в txt, csv и json
+
+SHOPPING_CART_PDF_MAX_ITEMS = env.int(
+    'SHOPPING_CART_PDF_MAX_ITEMS', default=1000
+)
+
+# Сколько ингредиентов отдавать в автодополнении
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = env.int(
+    'INGREDIENT_AUTOCOMPLETE_LIMIT', default=20
+)
+
+# Потоки фоновых задач (картинки рецептов, ленты подписок),
+# 0 - выполнять сразу
+
+BACKGROUND_WORKERS = env.int('BACKGROUND_WORKERS', default=2)
+
+# Ограничения на загружаемые картинки рецептов: байты и пиксели
+
+RECIPE_IMAGE_MAX_SIZE = env.int(
+    'RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024
+)
+RECIPE_IMAGE_MAX_PIXELS = env.int(
+    'RECIPE_IMAGE_MAX_PIXELS', default=25_000_000
+)
+
+# Приблизительный count в пагинации: с какого размера таблицы вместо
+# COUNT без фильтров брать оценку PostgreSQL
+
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = env.int(
+    'PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=100_000
+)
+
+# Лента подписок: с какого числа подписчиков рецепты автора не
+# раскладываются по лентам, а читаются напрямую (обратно - ниже 90% порога),
+# сколько рецептов переносить в ленту при новой подписке и сколько
+# последних записей хранить в ленте каждого пользователя
+
+FEED_FAN_OUT_MAX_FOLLOWERS = env.int(
+    'FEED_FAN_OUT_MAX_FOLLOWERS', default=1000
+)
+FEED_BACKFILL_SIZE = env.int('FEED_BACKFILL_SIZE', default=100)
+FEED_MAX_ENTRIES = env.int('FEED_MAX_ENTRIES', default=500)
+
+# Сколько пользователей держать в кеше избранного, корзины и подписок
+# в памяти каждого процесса
+
+VIEWER_STATE_CACHE_SIZE = env.int('VIEWER_STATE_CACHE_SIZE', default=10_000)
+
+# Сколько секунд хранить ответы со списками и карточками рецептов для
+# анонимных пользователей. изменения рецептов сбрасывают их сразу,
+# счетчики избранного и подписчиков автора отстают не больше чем на это время
+
+RESPONSE_CACHE_TIMEOUT = env.int('RESPONSE_CACHE_TIMEOUT', default=60)
+
+# Кеш токенов авторизации в памяти каждого процесса: сколько токенов
+# держать и сколько секунд токен живет без проверки в базе.
+# выход и блокировка доходят до других процессов только через общий
+# кеш Django, поэтому без CACHE_URL кеш токенов выключен (0), а включить
+# его с кешем в памяти процесса не даст проверка users.E001
+
+TOKEN_CACHE_SIZE = env.int(
+    'TOKEN_CACHE_SIZE',
+    default=(
+        0 if CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHE_BACKENDS
+        else 10_000
+    ),
+)
+TOKEN_CACHE_TIMEOUT = env.int('TOKEN_CACHE_TIMEOUT', default=300)
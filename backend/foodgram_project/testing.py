@@ -0,0 +1,141 @@
+import re
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APITestCase
+
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe, Tag,
+                            TimelineEntry)
+from users.models import Follow
+
+User = get_user_model()
+
+SCHEMA_PATH = Path(settings.BASE_DIR).parent / 'docs' / 'openapi-schema.yml'
+MEDIA_ROOT = tempfile.mkdtemp()
+
+USERS_COUNT = 40
+RECIPES_PER_AUTHOR = 10
+INGREDIENTS_COUNT = 100
+INGREDIENTS_PER_RECIPE = 12
+
+
+def schema_endpoints():
+    """
+    Пары (путь, метод) из OpenAPI-схемы проекта
+    """
+    endpoints = set()
+    path = None
+    for line in SCHEMA_PATH.read_text(encoding='utf-8').splitlines():
+        path_match = re.match(r'^  (/\S+):$', line)
+        if path_match:
+            path = path_match.group(1)
+            continue
+        method_match = re.match(r'^    (get|post|put|patch|delete):$', line)
+        if path and method_match:
+            endpoints.add((path, method_match.group(1)))
+    return endpoints
+
+
+def seed_dataset():
+    """
+    Наполняет базу данными, похожими на боевые:
+    сотни рецептов, тысячи ингредиентов в рецептах и много подписок
+    """
+    User.objects.bulk_create([
+        User(
+            email=f'user{number}@foodgram.ru',
+            username=f'user{number}',
+            first_name=f'Имя{number}',
+            last_name=f'Фамилия{number}',
+        )
+        for number in range(USERS_COUNT)
+    ])
+    users = list(User.objects.order_by('pk'))
+    Tag.objects.bulk_create([
+        Tag(name='Завтрак', color='#E26C2D', slug='breakfast'),
+        Tag(name='Обед', color='#49B64E', slug='lunch'),
+        Tag(name='Ужин', color='#8775D2', slug='dinner'),
+    ])
+    tags = list(Tag.objects.order_by('pk'))
+    Ingredient.objects.bulk_create([
+        Ingredient(name=f'ингредиент {number}', measurement_unit='г')
+        for number in range(INGREDIENTS_COUNT)
+    ])
+    ingredients = list(Ingredient.objects.order_by('pk'))
+    Recipe.objects.bulk_create([
+        Recipe(
+            name=f'Рецепт {author.pk}-{number}',
+            author=author,
+            image='recipes/images/test.png',
+            text='Описание',
+            cooking_time=number + 1,
+        )
+        for author in users
+        for number in range(RECIPES_PER_AUTHOR)
+    ])
+    recipes = list(Recipe.objects.order_by('pk'))
+    Recipe.tags.through.objects.bulk_create([
+        Recipe.tags.through(recipe=recipe, tag=tags[index % len(tags)])
+        for index, recipe in enumerate(recipes)
+    ])
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(
+            recipe=recipe,
+            ingredient=ingredients[
+                (index + offset) % len(ingredients)
+            ],
+            amount=offset + 1,
+        )
+        for index, recipe in enumerate(recipes)
+        for offset in range(INGREDIENTS_PER_RECIPE)
+    ])
+    Follow.objects.bulk_create([
+        Follow(user=user, author=author)
+        for user in users
+        for author in users
+        if user.pk != author.pk and (user.pk + author.pk) % 3 == 0
+    ])
+    for follow in Follow.objects.all():
+        TimelineEntry.objects.add_author(follow.user_id, follow.author_id)
+    call_command('reconcile_counters', stdout=StringIO())
+    return users, tags, ingredients, recipes
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, TOKEN_CACHE_SIZE=10_000)
+class QueryCountTestCase(APITestCase):
+    """
+    Фиксирует количество SQL-запросов на каждый эндпоинт,
+    чтобы N+1 не возвращался незаметно
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users, cls.tags, cls.ingredients, cls.recipes = seed_dataset()
+        cls.user = cls.users[0]
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.anon_client = APIClient()
+        self.auth_client = APIClient()
+        self.auth_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def assertQueries(self, client, method, url, expected_status, number,
+                      data=None):
+        with self.assertNumQueries(number):
+            response = getattr(client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, expected_status)
+        return response
@@ -0,0 +1,23 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def get_version(key):
+    """
+    Версия данных из общего кеша Django, ее сравнивают с версией
+    копии в памяти процесса. вытесненная версия заводится заново
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    После commit меняет версию: копии в памяти всех процессов устаревают
+    """
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, None))
@@ -33,7 +33,7 @@ class IngredientInRecipeInline(TabularInline):
 
 @register(Recipe)
 class RecipeAdmin(ModelAdmin):
-    list_display = ('pk', 'name', 'author')
+    list_display = ('pk', 'name', 'author', 'favorites_count')
     list_filter = ['name', 'author', 'tags']
     inlines = (IngredientInRecipeInline,)
 
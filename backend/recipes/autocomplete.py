@@ -0,0 +1,35 @@
+from bisect import bisect_left
+
+
+class PrefixIndex:
+    """
+    Отсортированный по названию индекс ингредиентов в памяти процесса.
+    совпадения по началу названия ищутся бинарным поиском,
+    совпадения по подстроке добираются просмотром списка
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(
+            (name.lower(), pk) for name, pk in entries
+        )
+        self.names = [name for name, _ in self.entries]
+
+    def search(self, query, limit):
+        query = query.lower()
+        found = []
+        position = bisect_left(self.names, query)
+        while (
+            position < len(self.entries)
+            and len(found) < limit
+            and self.names[position].startswith(query)
+        ):
+            found.append(self.entries[position][1])
+            position += 1
+        if len(found) < limit:
+            prefixed = set(found)
+            for name, pk in self.entries:
+                if query in name and pk not in prefixed:
+                    found.append(pk)
+                    if len(found) == limit:
+                        break
+        return found
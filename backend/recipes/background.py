@@ -0,0 +1,39 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.BACKGROUND_WORKERS,
+            thread_name_prefix='recipes-background',
+        )
+    return _executor
+
+
+def _run_in_worker(task, args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', task)
+    finally:
+        connection.close()
+
+
+def run_in_background(task, *args):
+    """
+    Выполняет задачу в пуле потоков процесса,
+    при BACKGROUND_WORKERS = 0 - сразу в текущем потоке
+    """
+    if settings.BACKGROUND_WORKERS:
+        get_executor().submit(_run_in_worker, task, args)
+    else:
+        task(*args)
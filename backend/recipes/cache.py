@@ -0,0 +1,118 @@
+import hashlib
+import time
+from threading import Lock
+from types import MappingProxyType
+
+from django.apps import apps
+from django.conf import settings
+from django.db import router
+from django.utils.functional import cached_property
+
+from foodgram_project.versions import bump_version, get_version
+
+from .autocomplete import PrefixIndex
+
+
+class ReferenceSnapshot:
+    """
+    Неизменяемый снимок справочника одной версии.
+    строки уже в виде ответа API, поэтому их нельзя менять
+    """
+
+    def __init__(self, model, version, rows, expires=None):
+        self.model = model
+        self.version = version
+        self.expires = expires
+        self.rows = tuple(rows)
+        self.by_pk = MappingProxyType({row['id']: row for row in self.rows})
+
+    @cached_property
+    def etag(self):
+        # по содержимому: снимок, перечитанный по истечении срока без
+        # смены версии, не должен отдавать 304 на старые данные
+        return f'"{hashlib.md5(repr(self.rows).encode()).hexdigest()}"'
+
+    def is_fresh(self, version):
+        return self.version == version and (
+            self.expires is None or self.expires > time.monotonic()
+        )
+
+    @cached_property
+    def prefix_index(self):
+        return PrefixIndex((row['name'], row['id']) for row in self.rows)
+
+    def get_instance(self, pk):
+        row = self.by_pk.get(pk)
+        if row is None:
+            return None
+        return self.model.from_db(
+            router.db_for_read(self.model), list(row), list(row.values()),
+        )
+
+    def in_bulk(self, pks):
+        """
+        Как QuerySet.in_bulk: {pk: объект} для найденных ключей
+        """
+        instances = {}
+        for pk in pks:
+            instance = self.get_instance(pk)
+            if instance is not None:
+                instances[pk] = instance
+        return instances
+
+
+class ReferenceCache:
+    """
+    Кеш справочника в памяти процесса.
+    версия хранится в общем кеше Django, поэтому изменение в одном
+    воркере gunicorn или в manage.py сбрасывает снимки во всех остальных.
+    снимок живет не дольше REFERENCE_CACHE_TIMEOUT секунд на случай, если
+    сброс до процесса не дошел (например, кеш Django не общий)
+    """
+
+    snapshot_class = ReferenceSnapshot
+
+    def __init__(self, name, model_label, fields):
+        self.version_key = f'reference:{name}:version'
+        self.model_label = model_label
+        self.fields = fields
+        self._snapshot = None
+        self._lock = Lock()
+
+    def __deepcopy__(self, memo):
+        # передается в поля сериализаторов, которые DRF копирует
+        return self
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def snapshot(self) -> ReferenceSnapshot:
+        version = get_version(self.version_key)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.is_fresh(version):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or not snapshot.is_fresh(version):
+                model = self.model
+                snapshot = self.snapshot_class(
+                    model, version, self.load_rows(model),
+                    time.monotonic() + settings.REFERENCE_CACHE_TIMEOUT,
+                )
+                self._snapshot = snapshot
+        return snapshot
+
+    def load_rows(self, model):
+        return model.objects.order_by('pk').values(*self.fields)
+
+    def invalidate(self):
+        bump_version(self.version_key)
+
+
+tag_cache = ReferenceCache(
+    'tags', 'recipes.Tag', ('id', 'name', 'color', 'slug'),
+)
+ingredient_cache = ReferenceCache(
+    'ingredients', 'recipes.Ingredient', ('id', 'name', 'measurement_unit'),
+)
@@ -0,0 +1,52 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def actual_count(related_model, related_field):
+    """
+    Настоящее число связанных строк для каждой строки запроса
+    """
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk'),
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def shift(model, pk, counter, delta):
+    """
+    Сдвигает счетчик строки pk на delta, не опуская ниже нуля: строка
+    могла появиться в обход сигналов (bulk_create, загрузка фикстур)
+    """
+    model.objects.filter(pk=pk).update(
+        **{counter: Greatest(F(counter) + delta, 0)}
+    )
+
+
+def reconcile(model, counter, related_model, related_field, pks):
+    """
+    Исправляет счетчик у строк pks, если он разошелся с COUNT.
+    возвращает число исправленных строк
+    """
+    actual = actual_count(related_model, related_field)
+    return model.objects.filter(pk__in=pks).annotate(
+        actual=actual,
+    ).exclude(
+        **{counter: F('actual')}
+    ).update(**{counter: actual})
+
+
+def counters(recipe_model, user_model, favorite_model, follow_model):
+    """
+    Денормализованные счетчики: (модель, поле, что считается, по какому FK)
+    """
+    return (
+        (recipe_model, 'favorites_count', favorite_model, 'recipe'),
+        (user_model, 'recipes_count', recipe_model, 'author'),
+        (user_model, 'followers_count', follow_model, 'author'),
+    )
@@ -0,0 +1,67 @@
+from django.db import transaction
+from django.db.models import Count, Min
+
+
+def merge_rows(model, owner_field, amount_field, keep_id, duplicate_ids):
+    """
+    Переносит строки дубликатов на оставляемый ингредиент.
+    если у владельца уже есть строка с ним, количества складываются
+    """
+    rows = model.objects.select_for_update().filter(
+        ingredient_id__in=[keep_id, *duplicate_ids]
+    ).order_by('pk')
+    targets = {}
+    to_delete = []
+    for row in sorted(rows, key=lambda row: row.ingredient_id != keep_id):
+        target = targets.get(getattr(row, owner_field))
+        if target is None:
+            targets[getattr(row, owner_field)] = row
+            continue
+        setattr(
+            target,
+            amount_field,
+            getattr(target, amount_field) + getattr(row, amount_field),
+        )
+        to_delete.append(row.pk)
+    model.objects.filter(pk__in=to_delete).delete()
+    for row in targets.values():
+        row.ingredient_id = keep_id
+    model.objects.bulk_update(
+        list(targets.values()), ['ingredient', amount_field]
+    )
+
+
+def merge_duplicate_ingredients(ingredient_model, ingredient_in_recipe_model,
+                                shopping_list_item_model):
+    """
+    Сливает ингредиенты с одинаковыми названием и единицей измерения.
+    каждая группа сливается в своей короткой транзакции,
+    принимает модели, чтобы работать и из миграций
+    """
+    groups = ingredient_model.objects.values(
+        'name', 'measurement_unit',
+    ).annotate(
+        keep_id=Min('pk'), copies=Count('pk'),
+    ).filter(copies__gt=1).order_by()
+    merged = 0
+    for group in list(groups):
+        with transaction.atomic():
+            duplicate_ids = list(
+                ingredient_model.objects.filter(
+                    name=group['name'],
+                    measurement_unit=group['measurement_unit'],
+                ).exclude(
+                    pk=group['keep_id'],
+                ).values_list('pk', flat=True)
+            )
+            merge_rows(
+                ingredient_in_recipe_model, 'recipe_id', 'amount',
+                group['keep_id'], duplicate_ids,
+            )
+            merge_rows(
+                shopping_list_item_model, 'user_id', 'total',
+                group['keep_id'], duplicate_ids,
+            )
+            ingredient_model.objects.filter(pk__in=duplicate_ids).delete()
+        merged += len(duplicate_ids)
+    return merged
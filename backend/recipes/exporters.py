@@ -0,0 +1,152 @@
+import csv
+import json
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 12
+PDF_LEADING = 18
+PDF_MARGIN = 50
+SPOOL_SIZE = 1024 * 1024
+FILE_CHUNK_SIZE = 64 * 1024
+PDF_TRUNCATED = 'Список не поместился целиком, полный список - в формате CSV'
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    Рендерер форматов выгрузки списка покупок.
+    сам файл отдается потоком из вью, рендерер нужен для
+    согласования формата (?format=...) и вывода ошибок
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class PlainTextRenderer(ExportRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(ExportRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+def format_item(item):
+    return f"{item['name']} ({item['units']}) - {item['total']}"
+
+
+def stream_txt(items):
+    for item in items:
+        yield format_item(item) + '\n'
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer: возвращает строку вместо записи
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for item in items:
+        yield writer.writerow((item['name'], item['units'], item['total']))
+
+
+def stream_json(items):
+    yield '['
+    separator = ''
+    for item in items:
+        yield separator + json.dumps(
+            {
+                'name': item['name'],
+                'measurement_unit': item['units'],
+                'amount': item['total'],
+            },
+            ensure_ascii=False,
+        )
+        separator = ','
+    yield ']'
+
+
+def _register_pdf_font():
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_CART_PDF_FONT)
+        )
+
+
+def stream_pdf(items):
+    """
+    Рисует PDF по мере чтения курсора. reportlab держит готовые
+    страницы в памяти до save(), поэтому файл отдается кусками только
+    целиком собранным, а в него попадает не больше
+    SHOPPING_CART_PDF_MAX_ITEMS позиций
+    """
+    _register_pdf_font()
+    width, height = A4
+    with SpooledTemporaryFile(max_size=SPOOL_SIZE) as buffer:
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        pdf.setTitle('Список покупок')
+        pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+        y = height - PDF_MARGIN
+        for number, item in enumerate(items):
+            if number == settings.SHOPPING_CART_PDF_MAX_ITEMS:
+                line = PDF_TRUNCATED
+            else:
+                line = format_item(item)
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(PDF_FONT_NAME, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, line)
+            y -= PDF_LEADING
+            if line is PDF_TRUNCATED:
+                break
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(FILE_CHUNK_SIZE), b'')
+
+
+def spool(chunks, charset):
+    """
+    Собирает выгрузку во временный файл: до SPOOL_SIZE в памяти,
+    дальше на диске. под ASGI Django 3.2 читает StreamingHttpResponse
+    в event loop, где курсор базы недоступен, поэтому файл собирается
+    еще во вью, а event loop только читает его кусками
+    """
+    buffer = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode(charset or 'utf-8')
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+EXPORTERS = {
+    PlainTextRenderer.format: stream_txt,
+    CSVRenderer.format: stream_csv,
+    JSONRenderer.format: stream_json,
+    PDFRenderer.format: stream_pdf,
+}
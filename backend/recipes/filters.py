@@ -1,18 +1,24 @@
+from django.conf import settings
 from django_filters import rest_framework as my_filters
 
-from .models import Ingredient, Recipe
+from .models import Ingredient, Recipe, Tag
+from .search import search_recipes
+from .viewer_state import get_viewer_state
 
 
 class IngredientFilter(my_filters.FilterSet):
     """
-    Фильтр ингредиентов.
-    положение буквы или слова в названии не имеет значения
+    Фильтр ингредиентов для автодополнения.
+    положение буквы или слова в названии не имеет значения,
+    но совпадения по началу названия идут первыми
     """
 
-    name = my_filters.CharFilter(
-        field_name='name',
-        lookup_expr='icontains'
-    )
+    name = my_filters.CharFilter(method='get_name')
+
+    def get_name(self, queryset, name, value):
+        return queryset.autocomplete(
+            value, settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        )
 
     class Meta:
         model = Ingredient
@@ -23,24 +29,46 @@ class RecipeFilter(my_filters.FilterSet):
     """
     Фильтр рецептов
     """
-    tags = my_filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = my_filters.ModelMultipleChoiceFilter(
+        field_name='tags__slug',
+        to_field_name='slug',
+        queryset=Tag.objects.all(),
+    )
     is_favorited = my_filters.BooleanFilter(
         method='get_is_favorited',
     )
     is_in_shopping_cart = my_filters.BooleanFilter(
         method='get_is_in_shopping_cart',
     )
+    search = my_filters.CharFilter(method='get_search')
+    ordering = my_filters.ChoiceFilter(
+        choices=(
+            ('popular', 'Популярные'),
+            ('trending', 'В тренде'),
+        ),
+        method='get_ordering',
+    )
 
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(
+                pk__in=get_viewer_state(self.request).favorites
+            )
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(shopping_cart__user=self.request.user)
+            return queryset.filter(
+                pk__in=get_viewer_state(self.request).shopping_cart
+            )
         return queryset
 
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by(f'-{value}_score', '-pub_date', '-id')
+
     class Meta:
         model = Recipe
         fields = ('is_favorited', 'author', 'tags', 'is_in_shopping_cart')
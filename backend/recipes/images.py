@@ -0,0 +1,206 @@
+import base64
+import binascii
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps, features
+
+from .background import run_in_background
+
+logger = logging.getLogger(__name__)
+
+DECODE_CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Производные размеры: имя -> наибольшая сторона в пикселях
+DERIVATIVE_SIZES = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1600,
+}
+DERIVATIVE_QUALITY = 80
+DERIVATIVES_DIR = 'derivatives'
+
+
+def derivative_formats():
+    formats = ['webp']
+    if features.check('avif'):
+        formats.append('avif')
+    return formats
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, которое называет файл по sha256 содержимого:
+    одинаковые загрузки сохраняются один раз
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, digest.hexdigest() + extension)
+        if self.exists(name):
+            return name
+        name = super().save(name, content, max_length)
+        if hasattr(content, 'temporary_file_path'):
+            # временный файл уже перемещен в хранилище, закрываем его
+            # сразу, иначе сборщик мусора попытается удалить его еще раз
+            content.close()
+        return name
+
+    def save_as(self, name, content):
+        """
+        Сохраняет файл ровно под этим именем, если его еще нет
+        """
+        if not self.exists(name):
+            name = super().save(name, content)
+        return name
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+class TooManyPixels(ValueError):
+    pass
+
+
+def decoded_size(encoded, start=0):
+    """
+    Размер данных после декодирования base64, без самого декодирования
+    """
+    return (len(encoded) - start) * 3 // 4 - encoded[-2:].count('=')
+
+
+def decode_data_uri(data, max_size=None):
+    """
+    Декодирует data:image;base64 кусками прямо во временный файл,
+    не создавая копий строки и полной картинки в памяти.
+    слишком большие данные отклоняются до декодирования
+    """
+    header, separator, _ = data[:256].partition(';base64,')
+    if not separator:
+        raise ValueError('Ожидается data:image в base64')
+    extension = header.split('/')[-1]
+    start = len(header) + len(separator)
+    if max_size is not None and decoded_size(data, start) > max_size:
+        raise FileTooLarge(max_size)
+    file = TemporaryUploadedFile(
+        f'upload.{extension}', f'image/{extension}', 0, None,
+    )
+    size = 0
+    try:
+        for position in range(start, len(data), DECODE_CHUNK_SIZE):
+            chunk = base64.b64decode(
+                data[position:position + DECODE_CHUNK_SIZE], validate=True
+            )
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise FileTooLarge(max_size)
+            file.write(chunk)
+    except (binascii.Error, ValueError):
+        file.close()
+        raise
+    file.size = size
+    file.seek(0)
+    return file
+
+
+def check_pixels(file, max_pixels):
+    """
+    Проверяет число пикселей по заголовку картинки: Pillow читает
+    только заголовок, сами пиксели не декодируются
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        raise TooManyPixels(max_pixels)
+    finally:
+        file.seek(0)
+    if width * height > max_pixels:
+        raise TooManyPixels(max_pixels)
+
+
+def derivative_name(source, size, image_format):
+    stem = posixpath.splitext(posixpath.basename(source))[0]
+    return posixpath.join(
+        posixpath.dirname(source), DERIVATIVES_DIR, stem,
+        f'{size}.{image_format}',
+    )
+
+
+def generate_derivatives(storage, source):
+    """
+    Строит уменьшенные копии картинки во всех форматах.
+    перекодирование выбрасывает EXIF, ориентация применяется заранее
+    """
+    derivatives = {'source': source}
+    missing = []
+    for size in DERIVATIVE_SIZES:
+        derivatives[size] = {}
+        for image_format in derivative_formats():
+            name = derivative_name(source, size, image_format)
+            derivatives[size][image_format] = name
+            if not storage.exists(name):
+                missing.append((size, image_format, name))
+    if not missing:
+        return derivatives
+
+    with storage.open(source, 'rb') as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        transparent = (
+            'A' in image.getbands() or 'transparency' in image.info
+        )
+        image = image.convert('RGBA' if transparent else 'RGB')
+
+    resized = {}
+    for size, image_format, name in missing:
+        if size not in resized:
+            resized[size] = image.copy()
+            resized[size].thumbnail(
+                (DERIVATIVE_SIZES[size], DERIVATIVE_SIZES[size]),
+                Image.LANCZOS,
+            )
+        buffer = BytesIO()
+        resized[size].save(
+            buffer, format=image_format.upper(), quality=DERIVATIVE_QUALITY,
+        )
+        storage.save_as(name, ContentFile(buffer.getvalue()))
+    return derivatives
+
+
+def process_recipe_image(source):
+    """
+    Строит производные и записывает их во все рецепты с этой
+    картинкой (одинаковые загрузки делят один файл)
+    """
+    from .models import Recipe
+
+    storage = Recipe._meta.get_field('image').storage
+    try:
+        derivatives = generate_derivatives(storage, source)
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', source)
+        return
+    Recipe.objects.filter(image=source).update(image_derivatives=derivatives)
+
+
+def schedule_recipe_image(source):
+    run_in_background(process_recipe_image, source)
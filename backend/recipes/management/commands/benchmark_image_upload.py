@@ -0,0 +1,99 @@
+import base64
+import os
+import resource
+import time
+from io import BytesIO
+from multiprocessing import get_context
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+from rest_framework import serializers
+
+from recipes.serializers import Base64ImageField
+
+
+def make_payload(size_mb):
+    """
+    Несжимаемая картинка PNG примерно заданного размера в виде data:image
+    """
+    side = int((size_mb * 1024 * 1024 / 3) ** 0.5)
+    image = Image.frombytes('RGB', (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    image.save(buffer, format='PNG', compress_level=0)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return 'data:image/png;base64,' + encoded
+
+
+def legacy_decode(data):
+    """
+    Прежний Base64ImageField: вся строка декодируется в память
+    и только потом передается Pillow
+    """
+    format, imgstr = data.split(';base64,')
+    ext = format.split('/')[-1]
+    data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+    return serializers.ImageField().to_internal_value(data)
+
+
+def unlimited_decode(data):
+    with override_settings(
+        RECIPE_IMAGE_MAX_SIZE=len(data), RECIPE_IMAGE_MAX_PIXELS=10 ** 9,
+    ):
+        return Base64ImageField().to_internal_value(data)
+
+
+CASES = (
+    ('до изменения', legacy_decode),
+    ('с ограничениями', Base64ImageField().to_internal_value),
+    ('без ограничений', unlimited_decode),
+)
+
+
+def measure(decode, payload, results):
+    # в дочернем процессе ru_maxrss начинается с RSS на момент fork
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.monotonic()
+    try:
+        decode(payload)
+        outcome = 'принято'
+    except serializers.ValidationError:
+        outcome = 'отклонено'
+    elapsed = time.monotonic() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((outcome, (peak - baseline) / 1024, elapsed))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пиковую память (RSS) при загрузке большой картинки '
+        'в base64 до и после ограничений размера. Только Linux'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size-mb',
+            type=int,
+            default=40,
+            help='Примерный размер картинки до кодирования в base64',
+        )
+
+    def handle(self, *args, **options):
+        payload = make_payload(options['size_mb'])
+        self.stdout.write(
+            f'Размер data:image: {len(payload) / 1024 / 1024:.1f} МБ'
+        )
+        context = get_context('fork')
+        for title, decode in CASES:
+            results = context.Queue()
+            process = context.Process(
+                target=measure, args=(decode, payload, results),
+            )
+            process.start()
+            outcome, peak_mb, elapsed = results.get()
+            process.join()
+            self.stdout.write(
+                f'{title:>16}: {outcome:<10} '
+                f'прирост пиковой RSS {peak_mb:7.1f} МБ, {elapsed:.2f} с'
+            )
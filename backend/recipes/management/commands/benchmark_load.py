@@ -0,0 +1,112 @@
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ('/api/tags/', '/api/ingredients/?name=%D0%B0')
+
+
+def percentile(values, share):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Client(threading.local):
+    """
+    Одно keep-alive соединение на поток нагрузки
+    """
+
+    def __init__(self, url, headers):
+        parts = urlsplit(url)
+        connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.headers = headers
+
+    def request(self, path):
+        """
+        (статус, секунды), статус 0 - ошибка соединения
+        """
+        started = time.monotonic()
+        try:
+            self.connection.request('GET', path, headers=self.headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            status = 0
+        return status, time.monotonic() - started
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагружает запущенный бэкенд GET-запросами и выводит запросы в '
+        'секунду и задержки p50/p99. запускается по очереди против WSGI '
+        'и ASGI (infra/docker-compose.asgi.yml) с одинаковыми параметрами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help='Адрес бэкенда, например http://localhost:8000',
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help=(
+                'Путь запроса, можно несколько. по умолчанию список тегов '
+                'и поиск ингредиентов'
+            ),
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            help='Сколько запросов сделать на каждый путь',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Сколько запросов держать одновременно',
+        )
+        parser.add_argument(
+            '--token', help='Токен пользователя для заголовка Authorization',
+        )
+
+    def handle(self, *args, **options):
+        if urlsplit(options['url']).scheme not in ('http', 'https'):
+            raise CommandError('Нужен адрес вида http://host:port')
+        headers = {}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+        client = Client(options['url'], headers)
+        prefix = urlsplit(options['url']).path.rstrip('/')
+        concurrency = options['concurrency']
+        self.stdout.write(f'Одновременных запросов: {concurrency}')
+        for path in options['paths'] or DEFAULT_PATHS:
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(
+                    client.request, [prefix + path] * options['requests'],
+                ))
+            elapsed = time.monotonic() - started
+            timings = [
+                seconds * 1000 for status, seconds in results
+                if 200 <= status < 400
+            ]
+            errors = len(results) - len(timings)
+            self.stdout.write(
+                f'{path}: {len(results) / elapsed:8.1f} запросов/с, '
+                f'p50 {percentile(timings, 0.5):7.1f} мс, '
+                f'p99 {percentile(timings, 0.99):7.1f} мс, '
+                f'ошибок {errors}'
+            )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.cache import ingredient_cache
+from recipes.dedupe import merge_duplicate_ingredients
+from recipes.models import Ingredient, IngredientInRecipe, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Сливает ингредиенты с одинаковыми названием и единицей измерения, '
+        'перенося на оставшийся ингредиент рецепты и списки покупок'
+    )
+
+    def handle(self, *args, **options):
+        merged = merge_duplicate_ingredients(
+            Ingredient, IngredientInRecipe, ShoppingListItem
+        )
+        ingredient_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено дубликатов ингредиентов: {merged}'
+        ))
@@ -0,0 +1,156 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.cache import ingredient_cache
+from recipes.models import Ingredient
+
+DEFAULT_PATH = Path(settings.BASE_DIR).parent / 'data' / 'ingredients.csv'
+READ_CHUNK_SIZE = 64 * 1024
+STAGING_TABLE = 'ingredient_staging'
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def skip_separators(buffer, position):
+    while position < len(buffer) and buffer[position] in ' \t\r\n,':
+        position += 1
+    return position
+
+
+def read_json(file):
+    """
+    Читает массив объектов JSON по одному, не загружая файл целиком
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается массив объектов JSON')
+    buffer = buffer[1:]
+    chunk = buffer
+    while True:
+        position = skip_separators(buffer, 0)
+        while position < len(buffer) and buffer[position] != ']':
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item['name'], item['measurement_unit']
+            position = skip_separators(buffer, position)
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        if not chunk:
+            raise CommandError('Файл JSON обрывается на середине')
+        chunk = file.read(READ_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON без дубликатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=str(DEFAULT_PATH),
+            help='Файл CSV (название,единица) или JSON',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла, по умолчанию по расширению',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        readers = {'csv': read_csv, 'json': read_json}
+        if file_format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+
+        if connection.vendor == 'postgresql':
+            load_batch = self.copy_batch
+        else:
+            load_batch = self.bulk_create_batch
+            self.existing = set(
+                Ingredient.objects.values_list('name', 'measurement_unit')
+            )
+
+        started = time.monotonic()
+        read = created = 0
+        seen = set()
+        with path.open(encoding='utf-8') as file:
+            rows = readers[file_format](file)
+            for batch in batches(rows, options['batch_size']):
+                read += len(batch)
+                unique = []
+                for name, unit in batch:
+                    key = (name.strip(), unit.strip())
+                    if key[0] and key not in seen:
+                        seen.add(key)
+                        unique.append(key)
+                with transaction.atomic():
+                    created += load_batch(unique)
+
+        ingredient_cache.invalidate()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено ингредиентов: {created}, '
+            f'{read / elapsed:.0f} строк/с'
+        ))
+
+    def bulk_create_batch(self, rows):
+        new = [
+            Ingredient(name=name, measurement_unit=unit)
+            for name, unit in rows
+            if (name, unit) not in self.existing
+        ]
+        Ingredient.objects.bulk_create(new, ignore_conflicts=True)
+        self.existing.update(rows)
+        return len(new)
+
+    def copy_batch(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+                '(name varchar(150), measurement_unit varchar(150)) '
+                'ON COMMIT DELETE ROWS'
+            )
+            cursor.copy_expert(
+                f'COPY {STAGING_TABLE} (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT name, measurement_unit FROM {STAGING_TABLE} '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return cursor.rowcount
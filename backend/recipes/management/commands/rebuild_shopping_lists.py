@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingListItem
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок всех пользователей по их корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько пользователей пересчитывать в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(
+            User.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        items = 0
+        for start in range(0, len(user_ids), batch_size):
+            with transaction.atomic():
+                items += ShoppingListItem.objects.rebuild(
+                    user_ids[start:start + batch_size]
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано пользователей: {len(user_ids)}, позиций: {items}'
+        ))
@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import counters, reconcile
+from recipes.models import Favorite, Recipe
+from users.models import Follow
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет счетчики избранного, рецептов и подписчиков с COUNT '
+        'и исправляет расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк сверять в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, counter, related_model, related_field in counters(
+            Recipe, User, Favorite, Follow,
+        ):
+            pks = list(
+                model.objects.order_by('pk').values_list('pk', flat=True)
+            )
+            fixed = 0
+            for start in range(0, len(pks), batch_size):
+                with transaction.atomic():
+                    fixed += reconcile(
+                        model, counter, related_model, related_field,
+                        pks[start:start + batch_size],
+                    )
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}.{counter}: '
+                f'проверено {len(pks)}, исправлено {fixed}'
+            ))
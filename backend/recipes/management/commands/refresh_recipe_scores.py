@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.response_cache import ALL, response_cache
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает популярность и тренд рецептов для сортировки '
+        '?ordering=popular|trending. запускается по расписанию (cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько рецептов пересчитывать в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        recipe_ids = list(
+            Recipe.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        for start in range(0, len(recipe_ids), batch_size):
+            with transaction.atomic():
+                refresh_scores(recipe_ids[start:start + batch_size], now)
+        # сортировки по популярности в кеше ответов устарели
+        response_cache.bump(ALL)
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {len(recipe_ids)}'
+        ))
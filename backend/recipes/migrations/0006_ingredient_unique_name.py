@@ -0,0 +1,176 @@
+import django.db.models.functions.text
+from django.db import IntegrityError, migrations, models, transaction
+from django.db.models import Count, Min
+
+UNIQUE_INDEX = 'unique_ingredient'
+LOWER_INDEX = 'ingredient_name_lower_idx'
+BUILD_ATTEMPTS = 3
+
+unique_constraint = models.UniqueConstraint(
+    fields=('name', 'measurement_unit'), name=UNIQUE_INDEX,
+)
+lower_index = models.Index(
+    django.db.models.functions.text.Lower('name'), name=LOWER_INDEX,
+)
+
+
+def merge_rows(model, owner_field, amount_field, keep_id, duplicate_ids):
+    """
+    Переносит строки дубликатов на оставляемый ингредиент,
+    количества одного владельца складываются
+    """
+    rows = model.objects.select_for_update().filter(
+        ingredient_id__in=[keep_id, *duplicate_ids]
+    ).order_by('pk')
+    targets = {}
+    to_delete = []
+    for row in sorted(rows, key=lambda row: row.ingredient_id != keep_id):
+        target = targets.get(getattr(row, owner_field))
+        if target is None:
+            targets[getattr(row, owner_field)] = row
+            continue
+        setattr(
+            target,
+            amount_field,
+            getattr(target, amount_field) + getattr(row, amount_field),
+        )
+        to_delete.append(row.pk)
+    model.objects.filter(pk__in=to_delete).delete()
+    for row in targets.values():
+        row.ingredient_id = keep_id
+    model.objects.bulk_update(
+        list(targets.values()), ['ingredient', amount_field]
+    )
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Копия recipes.dedupe на моделях миграции: код приложения
+    со временем меняется, а миграция должна работать как раньше
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    groups = Ingredient.objects.values(
+        'name', 'measurement_unit',
+    ).annotate(
+        keep_id=Min('pk'), copies=Count('pk'),
+    ).filter(copies__gt=1).order_by()
+    for group in list(groups):
+        with transaction.atomic():
+            duplicate_ids = list(
+                Ingredient.objects.filter(
+                    name=group['name'],
+                    measurement_unit=group['measurement_unit'],
+                ).exclude(
+                    pk=group['keep_id'],
+                ).values_list('pk', flat=True)
+            )
+            merge_rows(
+                apps.get_model('recipes', 'IngredientInRecipe'),
+                'recipe_id', 'amount', group['keep_id'], duplicate_ids,
+            )
+            merge_rows(
+                apps.get_model('recipes', 'ShoppingListItem'),
+                'user_id', 'total', group['keep_id'], duplicate_ids,
+            )
+            Ingredient.objects.filter(pk__in=duplicate_ids).delete()
+
+
+def drop_invalid_index(schema_editor, name):
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет INVALID индекс,
+    который IF NOT EXISTS пропустил бы
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT NOT indisvalid FROM pg_index '
+            'WHERE indexrelid = to_regclass(%s)',
+            [name],
+        )
+        row = cursor.fetchone()
+    if row and row[0]:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY {name}')
+
+
+def add_indexes(apps, schema_editor):
+    """
+    В PostgreSQL индексы строятся CONCURRENTLY, без блокировки записи,
+    а ограничение подключается к уже готовому уникальному индексу.
+    дубликаты, вставленные во время построения, сливаются,
+    и индекс строится заново
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.execute(
+            f'CREATE UNIQUE INDEX {UNIQUE_INDEX} '
+            'ON recipes_ingredient (name, measurement_unit)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX {LOWER_INDEX} ON recipes_ingredient (LOWER(name))'
+        )
+        return
+    drop_invalid_index(schema_editor, LOWER_INDEX)
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {LOWER_INDEX} '
+        'ON recipes_ingredient (LOWER(name))'
+    )
+    for attempt in range(BUILD_ATTEMPTS):
+        drop_invalid_index(schema_editor, UNIQUE_INDEX)
+        try:
+            schema_editor.execute(
+                f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+                f'{UNIQUE_INDEX} ON recipes_ingredient '
+                '(name, measurement_unit)'
+            )
+            break
+        except IntegrityError:
+            if attempt == BUILD_ATTEMPTS - 1:
+                raise
+            merge_duplicates(apps, schema_editor)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_constraint WHERE conname = %s', [UNIQUE_INDEX]
+        )
+        constraint_exists = cursor.fetchone() is not None
+    if not constraint_exists:
+        schema_editor.execute(
+            f'ALTER TABLE recipes_ingredient ADD CONSTRAINT {UNIQUE_INDEX} '
+            f'UNIQUE USING INDEX {UNIQUE_INDEX}'
+        )
+
+
+def remove_indexes(apps, schema_editor):
+    schema_editor.execute(f'DROP INDEX IF EXISTS {LOWER_INDEX}')
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE recipes_ingredient '
+            f'DROP CONSTRAINT IF EXISTS {UNIQUE_INDEX}'
+        )
+    else:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {UNIQUE_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0005_ingredient_name_trgm_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='ingredient',
+                    index=lower_index,
+                ),
+                migrations.AddConstraint(
+                    model_name='ingredient',
+                    constraint=unique_constraint,
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_indexes, remove_indexes),
+            ],
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+
+INDEX_NAME = 'recipe_search_vector_idx'
+
+# копия SQL из recipes.search: миграция не должна меняться
+# вместе с кодом приложения
+VECTOR_SQL = ' || '.join(
+    f"setweight(to_tsvector('{config}', coalesce({field}, '')), '{weight}')"
+    for config in ('russian', 'english')
+    for field, weight in (('name', 'A'), ('ingredients', 'B'), ('text', 'C'))
+)
+
+REFRESH_SQL = f"""
+    UPDATE recipes_recipe SET search_vector = {VECTOR_SQL}
+    FROM (
+        SELECT recipe.id AS recipe_id, string_agg(ingredient.name, ' ')
+            AS ingredients
+        FROM recipes_recipe recipe
+        LEFT JOIN recipes_ingredientinrecipe amount
+            ON amount.recipe_id = recipe.id
+        LEFT JOIN recipes_ingredient ingredient
+            ON ingredient.id = amount.ingredient_id
+        GROUP BY recipe.id
+    ) recipe_ingredients
+    WHERE recipes_recipe.id = recipe_ingredients.recipe_id
+"""
+
+
+def add_search_vector(apps, schema_editor):
+    """
+    Столбец tsvector и GIN-индекс есть только в PostgreSQL,
+    в остальных базах поиск идет по индексу в памяти
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'ALTER TABLE recipes_recipe '
+        'ADD COLUMN IF NOT EXISTS search_vector tsvector'
+    )
+    schema_editor.execute(REFRESH_SQL)
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+        'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    schema_editor.execute(
+        'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, drop_search_vector),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.7 on 2026-10-18 04:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+FAN_OUT_MAX_FOLLOWERS = 1000
+
+
+def fill_timeline(apps, schema_editor):
+    """
+    Дата публикации в записях лент и отметка популярных авторов
+    по уже посчитанному followers_count
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    User = apps.get_model('users', 'User')
+    TimelineEntry.objects.update(pub_date=Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe_id')).values('pub_date')
+    ))
+    User.objects.filter(
+        followers_count__gt=FAN_OUT_MAX_FOLLOWERS,
+    ).update(is_popular_author=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_search_vector'),
+        ('users', '0004_user_is_popular_author'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(null=True, verbose_name='Дата публикации рецепта'),
+        ),
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(verbose_name='Дата публикации рецепта'),
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+    ]
@@ -1,14 +1,63 @@
-from typing import Optional
+import heapq
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Exists, OuterRef
+from django.db import connection, connections, models, transaction
+from django.db.models import (Case, F, IntegerField, Prefetch, Q, Sum,
+                              Value, When, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, Lower, RowNumber
 from django.utils.text import slugify
 
+from users.models import Follow
+
+from .cache import ingredient_cache
+from .images import ContentAddressedStorage
+
 User = get_user_model()
 
 
+class IngredientQuerySet(models.QuerySet):
+    def named(self, name: str):
+        """
+        Ингредиенты с названием name без учета регистра,
+        по индексу на LOWER(name)
+        """
+        return self.alias(name_lower=Lower('name')).filter(
+            name_lower=Lower(Value(name))
+        )
+
+    def autocomplete(self, query: str, limit: int):
+        """
+        Ингредиенты, содержащие query: сначала точное совпадение
+        названия, затем по началу названия, затем по подстроке,
+        не больше limit штук
+        """
+        if connection.vendor == 'postgresql':
+            return self.filter(name__icontains=query).annotate(
+                rank=Case(
+                    When(
+                        pk__in=self.model.objects.named(query).values('pk'),
+                        then=Value(0),
+                    ),
+                    When(name__istartswith=query, then=Value(1)),
+                    default=Value(2),
+                    output_field=IntegerField(),
+                ),
+            ).order_by('rank', 'name')[:limit]
+        ids = ingredient_cache.snapshot().prefix_index.search(query, limit)
+        if not ids:
+            return self.none()
+        return self.filter(pk__in=ids).order_by(
+            Case(
+                *[When(pk=pk, then=Value(position))
+                  for position, pk in enumerate(ids)],
+                output_field=IntegerField(),
+            )
+        )
+
+
 class Ingredient(models.Model):
 
     """
@@ -25,9 +74,20 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения'
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
+        indexes = [
+            models.Index(Lower('name'), name='ingredient_name_lower_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.measurement_unit}'
@@ -66,20 +126,42 @@ class Tag(models.Model):
 
 
 class RecipeQuerySet(models.QuerySet):
-    def add_user_annotation(self, user_id: Optional[int]):
-        return self.annotate(
-            is_favorited=Exists(
-                Favorite.objects.filter(
-                    user_id=user_id, recipe__pk=OuterRef('pk')
-                )
-            ),
-            is_in_shopping_cart=Exists(
-                ShoppingCart.objects.filter(
-                    user_id=user_id, recipe__pk=OuterRef('pk')
-                )
+    def for_listing(self):
+        """
+        Рецепты со всеми связями, нужными RecipeListSerializer:
+        автор, теги и ингредиенты. запрос одинаков для всех
+        пользователей, их флаги берутся из viewer_state
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_amount',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ),
             ),
         )
 
+    def latest_per_author(self, author_ids, limit):
+        """
+        Не больше limit последних рецептов каждого автора,
+        одним запросом с ROW_NUMBER() по авторам
+        """
+        if not author_ids:
+            return self.none()
+        ranked = self.filter(author_id__in=author_ids).annotate(
+            author_rank=Window(
+                RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            ),
+        ).order_by().values('id', 'author_rank')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE author_rank <= %s',
+            (*params, limit),
+        ))
+
 
 class Recipe(models.Model):
 
@@ -115,9 +197,17 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         upload_to='recipes/images',
+        storage=ContentAddressedStorage(),
         verbose_name='Иллюстрация рецепта',
     )
 
+    image_derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии иллюстрации',
+    )
+
     text = models.TextField(
         verbose_name='Описание рецепта',
         blank=False,
@@ -134,12 +224,47 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
     )
 
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное',
+    )
+
+    popular_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность',
+    )
+
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Тренд',
+    )
+
     objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['-popular_score', '-pub_date', '-id'],
+                name='recipe_popular_idx',
+            ),
+            models.Index(
+                fields=['-trending_score', '-pub_date', '-id'],
+                name='recipe_trending_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -256,3 +381,371 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             )
         ]
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def apply_deltas(self, user_ids, deltas):
+        """
+        Прибавляет к итогам пользователей изменения количества
+        ингредиентов: {ingredient_id: delta}.
+        прибавка - одним INSERT ... ON CONFLICT DO UPDATE, чтобы два
+        одновременных добавления в корзину с общим новым ингредиентом
+        не столкнулись на unique_shopping_list_item
+        """
+        user_ids = list(user_ids)
+        added = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta > 0
+        }
+        removed = {
+            ingredient_id: -delta
+            for ingredient_id, delta in deltas.items() if delta < 0
+        }
+        if not user_ids:
+            return
+        if added:
+            self.upsert([
+                (user_id, ingredient_id, delta)
+                for user_id in user_ids
+                for ingredient_id, delta in added.items()
+            ])
+        if removed:
+            items = self.filter(
+                user_id__in=user_ids, ingredient_id__in=removed,
+            )
+            items.update(total=Greatest(
+                F('total') - Case(
+                    *(
+                        When(ingredient_id=ingredient_id, then=Value(amount))
+                        for ingredient_id, amount in removed.items()
+                    ),
+                    output_field=IntegerField(),
+                ),
+                0,
+            ))
+            items.filter(total=0).delete()
+
+    def upsert(self, rows):
+        """
+        Прибавляет total к строкам (user_id, ingredient_id, total),
+        недостающие создает. синтаксис общий у PostgreSQL и SQLite
+        """
+        opts = self.model._meta
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        fields = [
+            opts.get_field(name) for name in ('user', 'ingredient', 'total')
+        ]
+        table = quote(opts.db_table)
+        user, ingredient, total = (quote(field.column) for field in fields)
+        batch_size = connection.ops.bulk_batch_size(fields, rows)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} ({user}, {ingredient}, {total}) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT ({user}, {ingredient}) DO UPDATE '
+                    f'SET {total} = {table}.{total} + EXCLUDED.{total}',
+                    [value for row in batch for value in row],
+                )
+
+    def add_recipe(self, recipe_id, user_ids):
+        self.apply_deltas(user_ids, recipe_amounts(recipe_id))
+
+    def remove_recipe(self, recipe_id, user_ids):
+        self.apply_deltas(user_ids, {
+            ingredient_id: -amount
+            for ingredient_id, amount in recipe_amounts(recipe_id).items()
+        })
+
+    def rebuild(self, user_ids):
+        """
+        Пересчитывает итоги пользователей с нуля по их корзинам
+        """
+        user_ids = list(user_ids)
+        self.filter(user_id__in=user_ids).delete()
+        totals = IngredientInRecipe.objects.filter(
+            recipe__shopping_cart__user_id__in=user_ids,
+        ).values(
+            'ingredient_id',
+            user_id=F('recipe__shopping_cart__user_id'),
+        ).annotate(
+            amount=Sum('amount'),
+        ).order_by()
+        return len(self.bulk_create([
+            self.model(
+                user_id=total['user_id'],
+                ingredient_id=total['ingredient_id'],
+                total=total['amount'],
+            )
+            for total in totals
+        ]))
+
+
+def recipe_amounts(recipe_id):
+    return dict(
+        IngredientInRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount').order_by()
+    )
+
+
+class ShoppingListItem(models.Model):
+
+    """
+    Итоговое количество ингредиента в списке покупок пользователя.
+    поддерживается приращениями при изменении корзины и рецептов
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент',
+    )
+    total = models.PositiveIntegerField(
+        verbose_name='Общее количество',
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-total'],
+                name='shopping_list_user_total_idx',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.total}'
+
+
+def after_position(queryset, position, date_field, id_field):
+    """
+    Строки после позиции курсора (pub_date, id) при сортировке по убыванию
+    """
+    if position is None:
+        return queryset
+    pub_date, pk = position
+    return queryset.filter(
+        Q(**{f'{date_field}__lt': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__lt': pk})
+    )
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    def page(self, user_id, position, limit):
+        """
+        id не больше limit рецептов ленты после position, от новых к старым.
+        записи ленты и рецепты популярных авторов читаются по индексам
+        (user, pub_date, recipe) и (author, pub_date, id) и сливаются
+        """
+        entries = after_position(
+            self.filter(user_id=user_id), position, 'pub_date', 'recipe_id',
+        ).order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id',
+        )[:limit]
+        popular = after_position(
+            Recipe.objects.filter(author_id__in=Follow.objects.filter(
+                user_id=user_id, author__is_popular_author=True,
+            ).values('author_id')),
+            position, 'pub_date', 'id',
+        ).order_by('-pub_date', '-id').values_list('pub_date', 'id')[:limit]
+        recipe_ids = []
+        for _, recipe_id in heapq.merge(entries, popular, reverse=True):
+            if recipe_id not in recipe_ids:
+                recipe_ids.append(recipe_id)
+                if len(recipe_ids) == limit:
+                    break
+        return recipe_ids
+
+    def recipes_of(self, user_id):
+        """
+        Условие на рецепты ленты user_id: из ее записей или
+        популярных авторов из подписок. для ленты с фильтрами
+        """
+        return Q(pk__in=self.filter(user_id=user_id).values('recipe_id')) | Q(
+            author_id__in=Follow.objects.filter(
+                user_id=user_id, author__is_popular_author=True,
+            ).values('author_id')
+        )
+
+    def fan_out(self, recipe_id):
+        """
+        Добавляет рецепт в ленты подписчиков автора.
+        рецепты популярных авторов лента читает напрямую
+        """
+        recipe = Recipe.objects.filter(
+            pk=recipe_id, author__is_popular_author=False,
+        ).values('author_id', 'pub_date').first()
+        if recipe is None:
+            return 0
+        user_ids = list(Follow.objects.filter(
+            author_id=recipe['author_id']
+        ).values_list('user_id', flat=True))
+        if not user_ids:
+            return 0
+        created = len(self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    pub_date=recipe['pub_date'],
+                )
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True,
+        ))
+        self.trim(user_ids)
+        return created
+
+    def backfill(self, user_ids, author_id):
+        """
+        Переносит в ленты user_ids последние рецепты автора,
+        если он не популярный
+        """
+        if not user_ids:
+            return
+        recipes = list(Recipe.objects.filter(
+            author_id=author_id, author__is_popular_author=False,
+        ).order_by('-pub_date', '-id').values_list(
+            'pk', 'pub_date',
+        )[:settings.FEED_BACKFILL_SIZE])
+        if not recipes:
+            return
+        self.bulk_create(
+            [
+                self.model(
+                    user_id=user_id, recipe_id=recipe_id, pub_date=pub_date,
+                )
+                for user_id in user_ids
+                for recipe_id, pub_date in recipes
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        self.trim(user_ids)
+
+    def add_author(self, user_id, author_id):
+        """
+        Переносит в ленту последние рецепты нового автора в подписках
+        """
+        self.backfill([user_id], author_id)
+
+    def remove_author(self, user_id, author_id):
+        self.filter(user_id=user_id, recipe__author_id=author_id).delete()
+
+    def trim(self, user_ids):
+        """
+        Оставляет в лентах user_ids не больше FEED_MAX_ENTRIES
+        последних записей, одним запросом с ROW_NUMBER()
+        """
+        if not user_ids:
+            return
+        ranked = self.filter(user_id__in=user_ids).annotate(
+            entry_rank=Window(
+                RowNumber(),
+                partition_by=[F('user_id')],
+                order_by=[F('pub_date').desc(), F('recipe_id').desc()],
+            ),
+        ).order_by().values('id', 'entry_rank')
+        sql, params = ranked.query.sql_with_params()
+        self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) ranked WHERE entry_rank > %s',
+            (*params, settings.FEED_MAX_ENTRIES),
+        )).delete()
+
+    def promote_author(self, author_id):
+        """
+        Автор с числом подписчиков больше FEED_FAN_OUT_MAX_FOLLOWERS
+        перестает раскладываться по лентам
+        """
+        User.objects.filter(
+            pk=author_id,
+            is_popular_author=False,
+            followers_count__gt=settings.FEED_FAN_OUT_MAX_FOLLOWERS,
+        ).update(is_popular_author=True)
+
+    def demote_author(self, author_id):
+        """
+        Автор, у которого подписчиков стало меньше 90% порога, снова
+        раскладывается по лентам: сначала его последние рецепты
+        переносятся в ленты подписчиков, иначе они пропали бы из лент
+        """
+        with transaction.atomic():
+            demoted = User.objects.filter(
+                pk=author_id,
+                is_popular_author=True,
+                followers_count__lt=(
+                    settings.FEED_FAN_OUT_MAX_FOLLOWERS * 9 // 10
+                ),
+            ).update(is_popular_author=False)
+            if demoted:
+                self.backfill(
+                    list(Follow.objects.filter(
+                        author_id=author_id
+                    ).values_list('user_id', flat=True)),
+                    author_id,
+                )
+
+
+class TimelineEntry(models.Model):
+
+    """
+    Рецепт в ленте подписок пользователя.
+    записывается фоновой задачей при публикации рецепта, дата публикации
+    скопирована из рецепта, чтобы лента читалась по индексу без Recipe
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта',
+    )
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Записи ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
@@ -0,0 +1,184 @@
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import TimelineEntry
+
+
+def estimated_rows(queryset):
+    """
+    Оценка числа строк таблицы по статистике PostgreSQL
+    """
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+def approximate_count(queryset):
+    """
+    Число объектов для пагинации.
+    из запроса убираются аннотации, сортировка и prefetch; для всей
+    большой таблицы в PostgreSQL берется оценка из pg_class, иначе точный
+    COUNT. точный COUNT не кешируется: подписки, рецепты автора и
+    небольшие таблицы меняются на глазах у пользователя
+    """
+    queryset = queryset.order_by().values('pk')
+    if (
+        not queryset.query.where
+        and connections[queryset.db].vendor == 'postgresql'
+    ):
+        estimate = estimated_rows(queryset)
+        if estimate >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
+class ApproximateCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return approximate_count(self.object_list)
+        return super().count
+
+    def page(self, number):
+        # оценка count может быть меньше настоящего числа строк,
+        # поэтому страница не обрезается по count, как в Paginator
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self,
+        )
+
+
+class ApproximateCountPagination(PageNumberPagination):
+    """
+    Постраничная выдача с приблизительным count
+    """
+    django_paginator_class = ApproximateCountPaginator
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class RecipePagination(ApproximateCountPagination):
+    """
+    Постраничная выдача рецептов.
+    по умолчанию по номерам страниц, с параметром ?cursor= - по курсору
+    на (pub_date, id) без COUNT и OFFSET: новые рецепты не сдвигают ленту
+    """
+    cursor_query_param = 'cursor'
+    cursor_ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def use_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.use_cursor(request)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        if queryset.query.order_by and (
+            tuple(queryset.query.order_by) != self.cursor_ordering
+        ):
+            raise ValidationError(
+                {'cursor': 'Курсор работает только с сортировкой по дате.'}
+            )
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param)
+        )
+        queryset = queryset.order_by(*self.cursor_ordering)
+        if position is not None:
+            pub_date, pk = position
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk)
+            )
+        page = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_position = (page[-1].pub_date, page[-1].pk)
+        return page
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value = base64.urlsafe_b64decode(cursor.encode()).decode()
+            pub_date, pk = value.rsplit('|', 1)
+            pub_date, pk = parse_datetime(pub_date), int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, pk
+
+    def encode_cursor(self, position):
+        pub_date, pk = position
+        value = f'{pub_date.isoformat()}|{pk}'
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class FeedPagination(RecipePagination):
+    """
+    Лента подписок: всегда по курсору.
+    без фильтров id рецептов страницы выбираются по ленте пользователя
+    и запрос рецептов получает только их. с фильтрами (теги, поиск,
+    избранное) курсор идет по отфильтрованным рецептам ленты, иначе
+    страница после фильтра оказалась бы короче
+    """
+    unfiltered_params = {'cursor', 'limit', 'format'}
+
+    def use_cursor(self, request):
+        return True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        user_id = request.user.pk
+        if set(request.query_params) - self.unfiltered_params:
+            queryset = queryset.filter(
+                TimelineEntry.objects.recipes_of(user_id)
+            )
+        else:
+            queryset = queryset.filter(pk__in=TimelineEntry.objects.page(
+                user_id,
+                self.decode_cursor(
+                    request.query_params.get(self.cursor_query_param)
+                ),
+                self.get_page_size(request) + 1,
+            ))
+        return super().paginate_queryset(queryset, request, view)
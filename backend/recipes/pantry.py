@@ -0,0 +1,187 @@
+import heapq
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, namedtuple
+from itertools import chain
+from threading import Lock
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+Match = namedtuple('Match', 'recipe_id coverage missing')
+PantrySnapshot = namedtuple('PantrySnapshot', 'version recipes postings')
+
+
+class PantryIndex:
+    """
+    Обратный индекс ингредиент -> отсортированный массив id рецептов
+    в памяти процесса, для подбора рецептов по продуктам пользователя.
+    изменения рецептов попадают в журнал в общем кеше Django: каждый
+    воркер догружает только измененные рецепты, а если журнал отстал
+    больше чем на max_lag записей - перестраивает индекс целиком
+    """
+
+    version_key = 'pantry:version'
+    max_lag = 1000
+
+    def __init__(self):
+        self.snapshot = None
+        self._lock = Lock()
+
+    def change_key(self, version):
+        return f'pantry:change:{version}'
+
+    def record_change(self, recipe_id):
+        """
+        Отмечает, что ингредиенты рецепта изменились или он удален
+        """
+        def record():
+            cache.add(self.version_key, 0, None)
+            version = cache.incr(self.version_key)
+            cache.set(self.change_key(version), recipe_id, None)
+        transaction.on_commit(record)
+
+    def load(self, recipe_ids=None):
+        """
+        {recipe_id: (ingredient_id, ...)} из базы, все или только recipe_ids
+        """
+        rows = apps.get_model('recipes', 'IngredientInRecipe').objects
+        if recipe_ids is not None:
+            rows = rows.filter(recipe_id__in=recipe_ids)
+        recipes = {}
+        for recipe_id, ingredient_id in rows.values_list(
+            'recipe_id', 'ingredient_id',
+        ).order_by('recipe_id', 'ingredient_id').iterator():
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        return {
+            recipe_id: tuple(ingredients)
+            for recipe_id, ingredients in recipes.items()
+        }
+
+    def rebuild(self, version):
+        recipes = self.load()
+        postings = {}
+        for recipe_id, ingredients in recipes.items():
+            for ingredient_id in ingredients:
+                postings.setdefault(ingredient_id, []).append(recipe_id)
+        return PantrySnapshot(version, recipes, {
+            ingredient_id: array('q', sorted(recipe_ids))
+            for ingredient_id, recipe_ids in postings.items()
+        })
+
+    def update(self, snapshot, version, changed):
+        """
+        Новый снимок из старого: копируются только словари и списки
+        рецептов затронутых ингредиентов, старый снимок не меняется
+        """
+        loaded = self.load(changed)
+        recipes = dict(snapshot.recipes)
+        postings = dict(snapshot.postings)
+        copied = set()
+
+        def posting(ingredient_id):
+            if ingredient_id not in copied:
+                copied.add(ingredient_id)
+                postings[ingredient_id] = array(
+                    'q', postings.get(ingredient_id, ()),
+                )
+            return postings[ingredient_id]
+
+        for recipe_id in changed:
+            for ingredient_id in recipes.pop(recipe_id, ()):
+                recipe_ids = posting(ingredient_id)
+                del recipe_ids[bisect_left(recipe_ids, recipe_id)]
+            if recipe_id in loaded:
+                recipes[recipe_id] = loaded[recipe_id]
+                for ingredient_id in loaded[recipe_id]:
+                    insort(posting(ingredient_id), recipe_id)
+        return PantrySnapshot(version, recipes, postings)
+
+    def build(self, snapshot, version):
+        if (
+            snapshot is None
+            or version < snapshot.version
+            or version - snapshot.version > self.max_lag
+        ):
+            return self.rebuild(version)
+        changes = cache.get_many([
+            self.change_key(number)
+            for number in range(snapshot.version + 1, version + 1)
+        ])
+        if len(changes) < version - snapshot.version:
+            return self.rebuild(version)
+        return self.update(snapshot, version, set(changes.values()))
+
+    def sync(self):
+        """
+        Актуальный снимок индекса.
+        снимок строит один поток, остальные тем временем читают
+        предыдущий; ждать приходится только до первой сборки
+        """
+        snapshot = self.snapshot
+        version = cache.get(self.version_key, 0)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self.snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = self.build(snapshot, version)
+                self.snapshot = snapshot
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def match(self, ingredient_ids):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов:
+        сначала с наибольшей долей имеющихся ингредиентов
+        """
+        pantry = set(ingredient_ids)
+        snapshot = self.sync()
+        hits = Counter(chain.from_iterable(
+            snapshot.postings.get(ingredient_id, ())
+            for ingredient_id in pantry
+        ))
+        return PantryMatches(snapshot.recipes, pantry, hits)
+
+
+class PantryMatches:
+    """
+    Ленивый список подобранных рецептов для пагинатора: len() - число
+    рецептов, срез [:n] ранжирует через heapq только первые n, а
+    недостающие ингредиенты собираются только для рецептов среза
+    """
+
+    def __init__(self, recipes, pantry, hits):
+        self.recipes = recipes
+        self.pantry = pantry
+        self.hits = hits
+
+    def __len__(self):
+        return len(self.hits)
+
+    def rank(self, hit):
+        recipe_id, found = hit
+        total = len(self.recipes[recipe_id])
+        return -found / total, total - found, -recipe_id
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, step = index.indices(len(self))
+        hits = heapq.nsmallest(stop, self.hits.items(), key=self.rank)
+        matches = []
+        for recipe_id, found in hits[start:stop:step]:
+            ingredients = self.recipes[recipe_id]
+            matches.append(Match(
+                recipe_id,
+                found / len(ingredients),
+                [pk for pk in ingredients if pk not in self.pantry],
+            ))
+        return matches
+
+
+pantry_index = PantryIndex()
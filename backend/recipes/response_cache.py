@@ -0,0 +1,95 @@
+import hashlib
+import random
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# изменился любой рецепт: списки без фильтров, поиск, сортировки
+ALL = 'all'
+# изменились справочники, которые встроены в каждый ответ
+EPOCH = 'epoch'
+
+
+def recipe_scope(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def tag_scope(tag_id):
+    return f'tag:{tag_id}'
+
+
+def recipe_scopes(recipe_id, author_id, tag_ids):
+    """
+    Все области, в ответы которых попадает рецепт
+    """
+    return [
+        ALL, recipe_scope(recipe_id), author_scope(author_id),
+        *map(tag_scope, tag_ids),
+    ]
+
+
+class ResponseCache:
+    """
+    Готовые ответы API в общем кеше Django.
+    ключ строится из адреса, нормализованных параметров запроса и
+    счетчиков версий областей (рецепт, автор, тег), от которых зависит
+    ответ: изменение рецепта сбрасывает только затронутые ответы
+    """
+
+    prefix = 'response'
+
+    def version_key(self, scope):
+        return f'{self.prefix}:version:{scope}'
+
+    def start_version(self, key):
+        # счетчик, вытесненный из кеша, начинается со случайного числа,
+        # чтобы не совпасть с версией еще живых старых ответов
+        cache.add(key, random.getrandbits(62), None)
+
+    def bump(self, *scopes):
+        for scope in set(scopes):
+            key = self.version_key(scope)
+            self.start_version(key)
+            try:
+                cache.incr(key)
+            except ValueError:
+                pass
+
+    def invalidate(self, *scopes):
+        transaction.on_commit(lambda: self.bump(*scopes))
+
+    def key(self, request, scopes):
+        scopes = sorted({EPOCH, *scopes})
+        keys = [self.version_key(scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            for key in missing:
+                self.start_version(key)
+            versions.update(cache.get_many(missing))
+        params = urlencode(sorted(
+            (name, value)
+            for name, values in request.query_params.lists()
+            for value in values
+        ))
+        raw = '|'.join([
+            request.build_absolute_uri(request.path),
+            params,
+            *(f'{key}={versions.get(key)}' for key in keys),
+        ])
+        return f'{self.prefix}:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def get(self, key):
+        return cache.get(key)
+
+    def set(self, key, data):
+        cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+
+
+response_cache = ResponseCache()
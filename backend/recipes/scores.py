@@ -0,0 +1,60 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# популярность - все добавления в избранное и корзины, вес события
+# падает вдвое за POPULAR_HALF_LIFE; тренд - только за TRENDING_WINDOW
+# и с быстрым затуханием
+POPULAR_HALF_LIFE = timedelta(days=30)
+TRENDING_HALF_LIFE = timedelta(days=1)
+TRENDING_WINDOW = timedelta(days=7)
+
+
+def activity(recipe_ids, trunc, since=None):
+    """
+    {recipe_id: [(момент, число событий), ...]} по избранному и корзинам,
+    события сгруппированы по дням или часам
+    """
+    buckets = defaultdict(list)
+    for model in (Favorite, ShoppingCart):
+        events = model.objects.filter(recipe_id__in=recipe_ids)
+        if since is not None:
+            events = events.filter(pub_date__gte=since)
+        rows = events.values(
+            'recipe_id', moment=trunc('pub_date'),
+        ).annotate(events=Count('pk')).order_by()
+        for row in rows:
+            buckets[row['recipe_id']].append((row['moment'], row['events']))
+    return buckets
+
+
+def decayed(buckets, now, half_life):
+    return sum(
+        events * 0.5 ** (max(now - moment, timedelta()) / half_life)
+        for moment, events in buckets
+    )
+
+
+def refresh_scores(recipe_ids, now):
+    """
+    Пересчитывает popular_score и trending_score рецептов
+    """
+    popular = activity(recipe_ids, TruncDay)
+    trending = activity(recipe_ids, TruncHour, now - TRENDING_WINDOW)
+    Recipe.objects.bulk_update(
+        [
+            Recipe(
+                pk=pk,
+                popular_score=decayed(popular[pk], now, POPULAR_HALF_LIFE),
+                trending_score=decayed(
+                    trending[pk], now, TRENDING_HALF_LIFE
+                ),
+            )
+            for pk in recipe_ids
+        ],
+        ['popular_score', 'trending_score'],
+    )
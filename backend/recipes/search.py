@@ -0,0 +1,180 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import (BooleanField, Case, FloatField, IntegerField,
+                              Value, When)
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+
+from .cache import ReferenceCache, ReferenceSnapshot
+
+SEARCH_CONFIGS = ('russian', 'english')
+
+# веса полей как у ts_rank для весов A, B и C
+FIELD_WEIGHTS = (
+    ('name', 'A', 1.0),
+    ('ingredients', 'B', 0.4),
+    ('text', 'C', 0.2),
+)
+
+TOKEN_RE = re.compile(r'\w+')
+
+# tsvector хранится в столбце, о котором Django не знает: так он не
+# попадает в каждый SELECT рецептов, а модели не зависят от psycopg2
+VECTOR_SQL = ' || '.join(
+    f"setweight(to_tsvector('{config}', coalesce({field}, '')), '{weight}')"
+    for config in SEARCH_CONFIGS
+    for field, weight, _ in FIELD_WEIGHTS
+)
+
+REFRESH_SQL = """
+    UPDATE recipes_recipe SET search_vector = {vector}
+    FROM (
+        SELECT recipe.id AS recipe_id, string_agg(ingredient.name, ' ')
+            AS ingredients
+        FROM recipes_recipe recipe
+        LEFT JOIN recipes_ingredientinrecipe amount
+            ON amount.recipe_id = recipe.id
+        LEFT JOIN recipes_ingredient ingredient
+            ON ingredient.id = amount.ingredient_id
+        {condition}
+        GROUP BY recipe.id
+    ) recipe_ingredients
+    WHERE recipes_recipe.id = recipe_ingredients.recipe_id
+"""
+
+QUERY_SQL = ' || '.join(
+    f"websearch_to_tsquery('{config}', %s)" for config in SEARCH_CONFIGS
+)
+
+
+def refresh_sql(condition=''):
+    return REFRESH_SQL.format(vector=VECTOR_SQL, condition=condition)
+
+
+def refresh_search_vectors(recipe_ids):
+    """
+    Пересобирает tsvector рецептов: название, ингредиенты и описание
+    """
+    recipe_ids = list(recipe_ids)
+    if connection.vendor != 'postgresql' or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            refresh_sql('WHERE recipe.id = ANY(%s)'), [recipe_ids]
+        )
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+class InvertedIndex:
+    """
+    Обратный индекс слов рецептов в памяти процесса, запасной вариант
+    полнотекстового поиска для баз без tsvector.
+    слова запроса ищутся по началу слова, нужны все слова запроса
+    """
+
+    def __init__(self, rows):
+        postings = defaultdict(dict)
+        for row in rows:
+            for field, _, weight in FIELD_WEIGHTS:
+                for token in tokenize(row[field]):
+                    posting = postings[token]
+                    if posting.get(row['id'], 0) < weight:
+                        posting[row['id']] = weight
+        self.tokens = sorted(postings)
+        self.postings = [postings[token] for token in self.tokens]
+
+    def matches(self, query_token):
+        found = {}
+        position = bisect_left(self.tokens, query_token)
+        while (
+            position < len(self.tokens)
+            and self.tokens[position].startswith(query_token)
+        ):
+            for recipe_id, weight in self.postings[position].items():
+                if found.get(recipe_id, 0) < weight:
+                    found[recipe_id] = weight
+            position += 1
+        return found
+
+    def search(self, query):
+        """
+        [(recipe_id, вес), ...] от лучших совпадений к худшим
+        """
+        scores = None
+        for query_token in set(tokenize(query)):
+            found = self.matches(query_token)
+            if scores is None:
+                scores = found
+            else:
+                scores = {
+                    recipe_id: score + found[recipe_id]
+                    for recipe_id, score in scores.items()
+                    if recipe_id in found
+                }
+        return sorted(
+            (scores or {}).items(), key=lambda item: (-item[1], -item[0])
+        )
+
+
+class RecipeSearchSnapshot(ReferenceSnapshot):
+    @cached_property
+    def inverted_index(self):
+        return InvertedIndex(self.rows)
+
+
+class RecipeSearchCache(ReferenceCache):
+    snapshot_class = RecipeSearchSnapshot
+
+    def load_rows(self, model):
+        ingredients = defaultdict(list)
+        for recipe_id, name in model.ingredients.through.objects.values_list(
+            'recipe_id', 'ingredient__name',
+        ).order_by():
+            ingredients[recipe_id].append(name)
+        return [
+            dict(row, ingredients=' '.join(ingredients[row['id']]))
+            for row in model.objects.order_by('pk').values(*self.fields)
+        ]
+
+
+recipe_search_cache = RecipeSearchCache(
+    'recipe_search', 'recipes.Recipe', ('id', 'name', 'text'),
+)
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, подходящие под запрос, от самых релевантных.
+    в PostgreSQL - по tsvector с GIN-индексом, иначе - по индексу в памяти
+    """
+    if connection.vendor == 'postgresql':
+        table = queryset.model._meta.db_table
+        params = [query] * len(SEARCH_CONFIGS)
+        return queryset.annotate(
+            search_match=RawSQL(
+                f'{table}.search_vector @@ ({QUERY_SQL})', params,
+                output_field=BooleanField(),
+            ),
+            search_rank=RawSQL(
+                f'ts_rank({table}.search_vector, {QUERY_SQL})', params,
+                output_field=FloatField(),
+            ),
+        ).filter(search_match=True).order_by(
+            '-search_rank', '-pub_date', '-id'
+        )
+    found = recipe_search_cache.snapshot().inverted_index.search(query)
+    if not found:
+        return queryset.none()
+    return queryset.filter(pk__in=[pk for pk, _ in found]).order_by(
+        Case(
+            *[When(pk=pk, then=Value(position))
+              for position, (pk, _) in enumerate(found)],
+            output_field=IntegerField(),
+        )
+    )
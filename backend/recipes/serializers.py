@@ -1,13 +1,17 @@
-import base64
+import binascii
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
 from django.db import transaction
 from rest_framework import serializers, status
 
 from users.serializers import UserSerializerCustom
+from .cache import ingredient_cache, tag_cache
+from .images import (FileTooLarge, TooManyPixels, check_pixels,
+                     decode_data_uri)
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .viewer_state import get_viewer_state
 
 User = get_user_model()
 
@@ -33,15 +37,82 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'too_large': 'Картинка больше {max_size} байт.',
+        'too_many_pixels': 'Картинка больше {max_pixels} пикселей.',
+    }
+
     def to_internal_value(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            try:
+                data = decode_data_uri(data, max_size)
+            except FileTooLarge:
+                self.fail('too_large', max_size=max_size)
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
+        elif getattr(data, 'size', 0) > max_size:
+            self.fail('too_large', max_size=max_size)
+
+        if hasattr(data, 'read'):
+            try:
+                check_pixels(data, max_pixels)
+            except TooManyPixels:
+                self.fail('too_many_pixels', max_pixels=max_pixels)
+            except (OSError, ValueError):
+                self.fail('invalid_image')
 
         return super().to_internal_value(data)
 
 
+class ImageDerivativesField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии иллюстрации:
+    {размер: {формат: url}}, пока копии не готовы - пустой словарь
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return {}
+        storage = Recipe._meta.get_field('image').storage
+        request = self.context.get('request')
+        urls = {}
+        for size, formats in value.items():
+            if size == 'source':
+                continue
+            urls[size] = {}
+            for image_format, name in formats.items():
+                url = storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls[size][image_format] = url
+        return urls
+
+
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Первичный ключ справочника, который проверяется по кешу
+    в памяти процесса без запроса к базе
+    """
+
+    def __init__(self, reference_cache, **kwargs):
+        self.reference_cache = reference_cache
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        instance = self.reference_cache.snapshot().get_instance(pk)
+        if instance is None:
+            self.fail('does_not_exist', pk_value=data)
+        return instance
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор ингердиентов в рецепте
@@ -62,10 +133,7 @@ class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
     Сериалзиатор создания рецепт-ингридентов
     """
     recipe = serializers.PrimaryKeyRelatedField(read_only=True)
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient',
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(source='ingredient')
     amount = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -83,10 +151,26 @@ class RecipeMiniSerializer(serializers.ModelSerializer):
         source='ingredient_amount',
         many=True
     )
+    is_favorited = serializers.BooleanField()
+    is_in_shopping_cart = serializers.BooleanField()
+    images = ImageDerivativesField(source='image_derivatives')
 
     class Meta:
         model = Recipe
-        fields = '__all__'
+        fields = (
+            'id',
+            'tags',
+            'author',
+            'ingredients',
+            'is_favorited',
+            'is_in_shopping_cart',
+            'name',
+            'image',
+            'images',
+            'text',
+            'cooking_time',
+            'favorites_count',
+        )
 
 
 class RecipeListSerializer(serializers.ModelSerializer):
@@ -101,6 +185,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.BooleanField()
     is_in_shopping_cart = serializers.BooleanField()
+    images = ImageDerivativesField(source='image_derivatives')
 
     class Meta:
         model = Recipe
@@ -113,8 +198,32 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time',
+            'favorites_count',
+        )
+
+    def to_representation(self, instance):
+        state = get_viewer_state(self.context.get('request'))
+        instance.is_favorited = instance.pk in state.favorites
+        instance.is_in_shopping_cart = instance.pk in state.shopping_cart
+        instance.author.is_subscribed = instance.author_id in state.following
+        return super().to_representation(instance)
+
+
+class PantryRecipeSerializer(RecipeListSerializer):
+    """
+    Рецепт в подборе по продуктам: доля имеющихся ингредиентов
+    и ингредиенты, которых не хватает
+    """
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'coverage',
+            'missing_ingredients',
         )
 
 
@@ -123,7 +232,8 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     Сериализатор обновления и добавления новых рецептов
     """
     ingredients = IngredientCreateInRecipeSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CachedPrimaryKeyRelatedField(
+        tag_cache,
         many=True,
         queryset=Tag.objects.all(),
     )
@@ -131,26 +241,37 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     author = UserSerializerCustom(required=False)
 
     def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        if not ingredients:
+        if not data:
             raise serializers.ValidationError(
                 {'ingredients': 'Вы забыли про ингредиенты'},
                 status.HTTP_400_BAD_REQUEST,
             )
-        valid_list = []
-        for ingredient in ingredients:
-            if ingredient in valid_list:
+        ids = set()
+        for ingredient in data:
+            if ingredient['ingredient'] in ids:
                 raise serializers.ValidationError(
                     {'ingredients': 'Ингредиенты должны быть уникальными'},
                     status.HTTP_400_BAD_REQUEST,
                 )
-            valid_list.append(ingredient)
-            if int(ingredient['amount']) < 1:
+            ids.add(ingredient['ingredient'])
+            if ingredient['amount'] < 1:
                 raise serializers.ValidationError(
                     {'ingredients':
                          'Количество ингердиента должно быть 1 или больше'},
                     status.HTTP_400_BAD_REQUEST,
                 )
+        found = ingredient_cache.snapshot().in_bulk(ids)
+        if len(found) < len(ids):
+            found.update(Ingredient.objects.in_bulk(ids - found.keys()))
+        missing = sorted(ids - found.keys())
+        if missing:
+            raise serializers.ValidationError(
+                {'ingredients':
+                     f'Несуществующие ингредиенты: {missing}'},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        for ingredient in data:
+            ingredient['ingredient'] = found[ingredient['ingredient']]
         return data
 
     @staticmethod
@@ -178,6 +299,55 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @staticmethod
+    def _update_data(ingredients, obj):
+        """
+        Приводит ингредиенты рецепта к новому списку, трогая только
+        изменившиеся строки. возвращает изменения количества
+        """
+        current = {
+            row.ingredient_id: row
+            for row in IngredientInRecipe.objects.select_for_update().filter(
+                recipe=obj
+            )
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in current.items()
+        }
+        new_amounts = {
+            ingredient['ingredient'].pk: ingredient['amount']
+            for ingredient in ingredients
+        }
+        to_create, to_update = [], []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is None:
+                to_create.append(IngredientInRecipe(
+                    recipe=obj, ingredient_id=ingredient_id, amount=amount,
+                ))
+            elif row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        to_delete = [
+            row.pk for ingredient_id, row in current.items()
+            if ingredient_id not in new_amounts
+        ]
+
+        if to_delete:
+            IngredientInRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+
+        return {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in old_amounts.keys() | new_amounts
+        }
+
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients', None)
@@ -185,15 +355,24 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         if tags is not None:
             instance.tags.set(tags)
         if ingredients is not None:
-            instance.ingredients.clear()
-        self._create_data(ingredients, instance)
+            deltas = self._update_data(ingredients, instance)
+            ShoppingListItem.objects.apply_deltas(
+                instance.shopping_cart.values_list('user_id', flat=True),
+                deltas,
+            )
 
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_listing().get(pk=instance.pk)
+        state = get_viewer_state(request)
+        instance.is_favorited = instance.pk in state.favorites
+        instance.is_in_shopping_cart = instance.pk in state.shopping_cart
+        instance.author.is_subscribed = instance.author_id in state.following
         return RecipeMiniSerializer(
             instance,
-            context={'request': self.context.get('request')},
+            context={'request': request},
         ).data
 
     class Meta:
@@ -0,0 +1,205 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from users.models import Follow
+
+from .background import run_in_background
+from .cache import ingredient_cache, tag_cache
+from .counters import shift
+from .images import schedule_recipe_image
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCart, Tag, TimelineEntry)
+from .pantry import pantry_index
+from .response_cache import (ALL, EPOCH, author_scope, recipe_scope,
+                             recipe_scopes, response_cache, tag_scope)
+from .search import recipe_search_cache, refresh_search_vectors
+from .viewer_state import viewer_state_cache
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(**kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(**kwargs):
+    tag_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, **kwargs):
+    if not created:
+        recipe_search_cache.invalidate()
+        recipe_ids = list(IngredientInRecipe.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True))
+        transaction.on_commit(lambda: refresh_search_vectors(recipe_ids))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    recipe_search_cache.invalidate()
+    pantry_index.record_change(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, **kwargs):
+    recipe_search_cache.invalidate()
+    recipe_id = instance.pk
+    pantry_index.record_change(recipe_id)
+    # ингредиенты сохраняются после рецепта, поэтому вектор - после commit
+    transaction.on_commit(lambda: refresh_search_vectors([recipe_id]))
+    source = instance.image.name
+    if source and instance.image_derivatives.get('source') != source:
+        transaction.on_commit(lambda: schedule_recipe_image(source))
+    if created:
+        transaction.on_commit(
+            lambda: run_in_background(TimelineEntry.objects.fan_out, recipe_id)
+        )
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def viewer_state_changed(instance, **kwargs):
+    viewer_state_cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(instance, created, **kwargs):
+    if created:
+        TimelineEntry.objects.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(instance, **kwargs):
+    TimelineEntry.objects.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_counted(instance, created, **kwargs):
+    if created:
+        shift(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_uncounted(instance, **kwargs):
+    shift(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_counted(instance, created, **kwargs):
+    if created:
+        shift(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_uncounted(instance, **kwargs):
+    shift(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_counted(instance, created, **kwargs):
+    if created:
+        shift(User, instance.author_id, 'followers_count', 1)
+        TimelineEntry.objects.promote_author(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_uncounted(instance, **kwargs):
+    author_id = instance.author_id
+    shift(User, author_id, 'followers_count', -1)
+    transaction.on_commit(lambda: run_in_background(
+        TimelineEntry.objects.demote_author, author_id,
+    ))
+
+
+def invalidate_recipe_responses(recipe_id):
+    """
+    После commit сбрасывает ответы со всеми текущими тегами рецепта
+    """
+    def bump():
+        recipe = Recipe.objects.filter(pk=recipe_id).values('author_id')
+        if not recipe:
+            return
+        response_cache.bump(*recipe_scopes(
+            recipe_id, recipe[0]['author_id'],
+            Recipe.tags.through.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('tag_id', flat=True),
+        ))
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_response_changed(instance, **kwargs):
+    invalidate_recipe_responses(instance.pk)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_response_deleted(instance, **kwargs):
+    response_cache.invalidate(*recipe_scopes(
+        instance.pk, instance.author_id,
+        instance.tags.values_list('pk', flat=True),
+    ))
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def recipe_ingredients_changed(instance, **kwargs):
+    invalidate_recipe_responses(instance.recipe_id)
+
+
+# поля автора, которые встроены в ответы с рецептами
+AUTHOR_PROFILE_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def author_response_changed(instance, created, update_fields, **kwargs):
+    """
+    После commit сбрасывает ответы с рецептами автора, если мог
+    измениться его профиль: вход (last_login) и пароль ответы не меняют
+    """
+    if created or (
+        update_fields is not None
+        and not AUTHOR_PROFILE_FIELDS.intersection(update_fields)
+    ):
+        return
+    author_id = instance.pk
+
+    def bump():
+        recipe_ids = list(Recipe.objects.filter(
+            author_id=author_id
+        ).values_list('pk', flat=True))
+        if not recipe_ids:
+            return
+        response_cache.bump(
+            ALL, author_scope(author_id), *map(recipe_scope, recipe_ids),
+            *map(tag_scope, Recipe.tags.through.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values_list('tag_id', flat=True).distinct()),
+        )
+    transaction.on_commit(bump)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action.startswith('post_'):
+            response_cache.invalidate(EPOCH)
+        return
+    if action == 'pre_clear':
+        pk_set = instance.tags.values_list('pk', flat=True)
+    elif action not in ('post_add', 'post_remove'):
+        return
+    response_cache.invalidate(*map(tag_scope, pk_set))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def reference_response_changed(**kwargs):
+    response_cache.invalidate(EPOCH)
@@ -1 +1,1171 @@
-# Create your tests here.
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from foodgram_project.testing import (INGREDIENTS_PER_RECIPE,
+                                      RECIPES_PER_AUTHOR, USERS_COUNT,
+                                      QueryCountTestCase)
+from users.models import Follow
+
+from .exporters import stream_pdf
+from .management.commands import load_ingredients
+from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                     ShoppingCart, ShoppingListItem, Tag, TimelineEntry)
+from .pantry import PantryIndex
+from .serializers import RecipeListSerializer
+
+User = get_user_model()
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=='
+)
+
+# Эндпоинты из docs/openapi-schema.yml, покрытые тестами этого модуля
+COVERED_ENDPOINTS = {
+    ('/api/tags/', 'get'),
+    ('/api/tags/{id}/', 'get'),
+    ('/api/ingredients/', 'get'),
+    ('/api/ingredients/{id}/', 'get'),
+    ('/api/recipes/', 'get'),
+    ('/api/recipes/', 'post'),
+    ('/api/recipes/feed/', 'get'),
+    ('/api/recipes/what_can_i_cook/', 'get'),
+    ('/api/recipes/state/', 'get'),
+    ('/api/recipes/{id}/', 'get'),
+    ('/api/recipes/{id}/', 'put'),
+    ('/api/recipes/{id}/', 'delete'),
+    ('/api/recipes/{id}/favorite/', 'get'),
+    ('/api/recipes/{id}/favorite/', 'delete'),
+    ('/api/recipes/{id}/shopping_cart/', 'get'),
+    ('/api/recipes/{id}/shopping_cart/', 'delete'),
+    ('/api/recipes/download_shopping_cart/', 'get'),
+}
+
+
+class RecipesQueryCountTest(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.own_recipe = self.user.recipes.first()
+        self.other_recipe = self.users[1].recipes.first()
+
+    def test_tags(self):
+        response = self.assertQueries(
+            self.anon_client, 'get', '/api/tags/', status.HTTP_200_OK, 1
+        )
+        self.assertQueries(
+            self.anon_client, 'get', f'/api/tags/{self.tags[0].pk}/',
+            status.HTTP_200_OK, 0,
+        )
+        with self.assertNumQueries(0):
+            response = self.anon_client.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(REFERENCE_CACHE_TIMEOUT=0)
+    def test_reference_cache_timeout(self):
+        etag = self.anon_client.get('/api/tags/')['ETag']
+        response = self.anon_client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # изменение без сброса версии, как из процесса с другим кешем
+        Tag.objects.filter(pk=self.tags[0].pk).update(name='Полдник')
+        response = self.anon_client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['name'], 'Полдник')
+
+    def test_ingredients(self):
+        response = self.assertQueries(
+            self.anon_client, 'get', '/api/ingredients/?name=ингр',
+            status.HTTP_200_OK, 2,
+        )
+        self.assertEqual(
+            len(response.data), settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        )
+        self.assertQueries(
+            self.anon_client, 'get', '/api/ingredients/?name=ингр',
+            status.HTTP_200_OK, 1,
+        )
+        self.assertQueries(
+            self.anon_client, 'get', '/api/ingredients/',
+            status.HTTP_200_OK, 0,
+        )
+        self.assertQueries(
+            self.anon_client, 'get',
+            f'/api/ingredients/{self.ingredients[0].pk}/',
+            status.HTTP_200_OK, 0,
+        )
+
+    def test_ingredient_autocomplete_ranking(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(
+                name='морская соль', measurement_unit='г'
+            )
+            Ingredient.objects.create(
+                name='Соль поваренная', measurement_unit='г'
+            )
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+        response = self.anon_client.get('/api/ingredients/?name=СОЛЬ')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            ['соль', 'Соль поваренная', 'морская соль'],
+        )
+        # LOWER в SQLite знает только латиницу
+        tofu = Ingredient.objects.create(name='Tofu', measurement_unit='г')
+        self.assertEqual(list(Ingredient.objects.named('TOFU')), [tofu])
+
+    def test_recipe_list(self):
+        response = self.assertQueries(
+            self.anon_client, 'get', '/api/recipes/', status.HTTP_200_OK, 4
+        )
+        self.assertEqual(
+            response.data['count'], USERS_COUNT * RECIPES_PER_AUTHOR
+        )
+        self.assertQueries(
+            self.auth_client, 'get', '/api/recipes/?page=3',
+            status.HTTP_200_OK, 6,
+        )
+        with CaptureQueriesContext(connection) as context:
+            self.auth_client.get('/api/recipes/?tags=lunch')
+        count_sql = next(
+            query['sql'] for query in context.captured_queries
+            if 'COUNT(' in query['sql']
+        )
+        self.assertIn('COUNT(*)', count_sql)
+        self.assertNotIn('ORDER BY', count_sql)
+        self.assertNotIn('EXISTS', count_sql)
+        self.assertQueries(
+            self.auth_client, 'get',
+            f'/api/recipes/?tags=lunch&tags=dinner&author={self.user.pk}',
+            status.HTTP_200_OK, 6,
+        )
+
+    def test_recipe_list_cursor(self):
+        response = self.assertQueries(
+            self.anon_client, 'get', '/api/recipes/?cursor=',
+            status.HTTP_200_OK, 3,
+        )
+        self.assertNotIn('count', response.data)
+        seen = [recipe['id'] for recipe in response.data['results']]
+        Recipe.objects.create(
+            author=self.user, name='Свежий рецепт', text='Описание',
+            cooking_time=5, image='recipes/images/test.png',
+        )
+        while response.data['next']:
+            response = self.anon_client.get(response.data['next'])
+            seen += [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), USERS_COUNT * RECIPES_PER_AUTHOR)
+        self.assertEqual(
+            self.anon_client.get('/api/recipes/?cursor=xyz').status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_feed(self):
+        response = self.assertQueries(
+            self.auth_client, 'get', '/api/recipes/feed/',
+            status.HTTP_200_OK, 7,
+        )
+        authors = set()
+        recipes_count = 0
+        while True:
+            for recipe in response.data['results']:
+                authors.add(recipe['author']['id'])
+                recipes_count += 1
+            if not response.data['next']:
+                break
+            response = self.auth_client.get(response.data['next'])
+        followed = set(
+            self.user.subscribed_to.values_list('author_id', flat=True)
+        )
+        self.assertEqual(authors, followed)
+        self.assertEqual(recipes_count, len(followed) * RECIPES_PER_AUTHOR)
+
+        # фильтры применяются до выбора страницы, страницы полные
+        User.objects.filter(pk=min(followed)).update(is_popular_author=True)
+        tag = self.tags[0]
+        expected = list(Recipe.objects.filter(
+            author__in=followed, tags=tag,
+        ).order_by('-pub_date', '-id').values_list('pk', flat=True))
+        self.assertGreater(len(expected), 10)
+        seen = []
+        response = self.auth_client.get(
+            f'/api/recipes/feed/?tags={tag.slug}&limit=5'
+        )
+        while True:
+            results = response.data['results']
+            seen.extend(recipe['id'] for recipe in results)
+            if not response.data['next']:
+                break
+            self.assertEqual(len(results), 5)
+            response = self.auth_client.get(response.data['next'])
+        self.assertEqual(seen, expected)
+        User.objects.filter(pk=min(followed)).update(is_popular_author=False)
+
+        author_id = min(followed)
+        for popular in (False, True):
+            User.objects.filter(pk=author_id).update(
+                is_popular_author=popular
+            )
+            with override_settings(BACKGROUND_WORKERS=0):
+                with self.captureOnCommitCallbacks(execute=True):
+                    recipe = Recipe.objects.create(
+                        author_id=author_id, name='Свежий рецепт',
+                        text='Описание', cooking_time=5,
+                        image='recipes/images/test.png',
+                        image_derivatives={
+                            'source': 'recipes/images/test.png',
+                        },
+                    )
+                response = self.auth_client.get('/api/recipes/feed/')
+            self.assertEqual(response.data['results'][0]['id'], recipe.pk)
+            self.assertEqual(
+                recipe.timeline.filter(user=self.user).exists(),
+                not popular,
+            )
+        self.assertEqual(
+            self.anon_client.get('/api/recipes/feed/').status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+    @override_settings(BACKGROUND_WORKERS=0, FEED_MAX_ENTRIES=5)
+    def test_feed_author_modes(self):
+        author = next(
+            user for user in self.users[1:]
+            if not Follow.objects.filter(user=self.user, author=user).exists()
+        )
+        author.refresh_from_db()
+        followers = author.followers_count
+        self.assertGreater(followers, 5)
+        with override_settings(FEED_FAN_OUT_MAX_FOLLOWERS=followers):
+            Follow.objects.create(user=self.user, author=author)
+            author.refresh_from_db()
+            self.assertTrue(author.is_popular_author)
+            self.assertFalse(
+                self.user.timeline.filter(recipe__author=author).exists()
+            )
+            response = self.auth_client.get('/api/recipes/feed/')
+            authors = [
+                recipe['author']['id'] for recipe in response.data['results']
+            ]
+            self.assertIn(author.pk, authors)
+
+            # ниже 90% порога автор снова раскладывается по лентам
+            while author.followers_count >= followers * 9 // 10:
+                with self.captureOnCommitCallbacks(execute=True):
+                    Follow.objects.filter(author=author).exclude(
+                        user=self.user
+                    ).first().delete()
+                author.refresh_from_db()
+            self.assertFalse(author.is_popular_author)
+        timeline = self.user.timeline.order_by('-pub_date', '-recipe_id')
+        self.assertEqual(timeline.count(), 5)
+        self.assertEqual(
+            list(timeline.values_list('recipe_id', flat=True)),
+            list(Recipe.objects.filter(
+                author__in=self.user.subscribed_to.values('author_id'),
+            ).values_list('pk', flat=True)[:5]),
+        )
+
+    @override_settings(BACKGROUND_WORKERS=0)
+    def test_feed_without_followers(self):
+        author = User.objects.create(username='newcomer', email='new@ya.ru')
+        client = APIClient()
+        client.force_authenticate(author)
+        data = {
+            'name': 'Первый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 5}],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(TimelineEntry.objects.filter(
+            recipe_id=response.data['id']
+        ).exists())
+
+        # последний подписчик ушел - автор перестает быть популярным
+        User.objects.filter(pk=author.pk).update(is_popular_author=True)
+        TimelineEntry.objects.demote_author(author.pk)
+        author.refresh_from_db()
+        self.assertFalse(author.is_popular_author)
+
+    def test_recipe_list_ordering(self):
+        old_hit, new_hit = self.recipes[5], self.recipes[6]
+        Favorite.objects.bulk_create([
+            Favorite(user=user, recipe=old_hit) for user in self.users[:3]
+        ] + [Favorite(user=self.users[0], recipe=new_hit)])
+        Favorite.objects.filter(recipe=old_hit).update(
+            pub_date=timezone.now() - timedelta(days=20)
+        )
+        call_command(
+            'refresh_recipe_scores', batch_size=50, stdout=StringIO()
+        )
+        for ordering, expected, queries in (
+            ('popular', [old_hit.pk, new_hit.pk], 4),
+            ('trending', [new_hit.pk], 4),
+        ):
+            response = self.assertQueries(
+                self.anon_client, 'get', f'/api/recipes/?ordering={ordering}',
+                status.HTTP_200_OK, queries,
+            )
+            self.assertEqual(
+                [recipe['id'] for recipe in response.data['results']][
+                    :len(expected)
+                ],
+                expected,
+            )
+        self.assertEqual(
+            self.anon_client.get(
+                '/api/recipes/?ordering=popular&cursor='
+            ).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_recipe_search(self):
+        by_name, by_text = self.recipes[10], self.recipes[20]
+        by_name.name = 'Борщ украинский'
+        by_name.save()
+        by_text.text = 'Почти как борщ, только без свеклы'
+        by_text.save()
+        beet = Ingredient.objects.create(
+            name='Свёкла столовая', measurement_unit='г'
+        )
+        IngredientInRecipe.objects.create(
+            recipe=by_name, ingredient=beet, amount=1
+        )
+        response = self.assertQueries(
+            self.anon_client, 'get', '/api/recipes/?search=борщ',
+            status.HTTP_200_OK, 6,
+        )
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [by_name.pk, by_text.pk],
+        )
+        response = self.anon_client.get('/api/recipes/?search=свекл борщ')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [by_name.pk, by_text.pk],
+        )
+        response = self.anon_client.get('/api/recipes/?search=укр свекл')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [by_name.pk],
+        )
+        self.assertEqual(
+            self.anon_client.get(
+                '/api/recipes/?search=несуществующее'
+            ).data['count'],
+            0,
+        )
+
+    def test_what_can_i_cook(self):
+        pantry = self.ingredients[:INGREDIENTS_PER_RECIPE]
+        url = '/api/recipes/what_can_i_cook/?ingredients=' + ','.join(
+            str(ingredient.pk) for ingredient in pantry
+        )
+        response = self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_200_OK, 7,
+        )
+        results = response.data['results']
+        complete = [
+            recipe.pk for recipe in self.recipes[::len(self.ingredients)]
+        ]
+        self.assertEqual(
+            [recipe['id'] for recipe in results[:len(complete)]],
+            sorted(complete, reverse=True),
+        )
+        self.assertEqual(results[0]['coverage'], 1)
+        self.assertEqual(results[0]['missing_ingredients'], [])
+        partial = results[len(complete)]
+        self.assertEqual(
+            partial['coverage'],
+            (INGREDIENTS_PER_RECIPE - 1) / INGREDIENTS_PER_RECIPE,
+        )
+        self.assertEqual(len(partial['missing_ingredients']), 1)
+        self.assertNotIn(
+            partial['missing_ingredients'][0]['id'],
+            {ingredient.pk for ingredient in pantry},
+        )
+
+        with override_settings(BACKGROUND_WORKERS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    author=self.user, name='Из того, что есть',
+                    text='Описание', cooking_time=5,
+                    image='recipes/images/test.png',
+                    image_derivatives={'source': 'recipes/images/test.png'},
+                )
+                IngredientInRecipe.objects.bulk_create([
+                    IngredientInRecipe(
+                        recipe=recipe, ingredient=ingredient, amount=1
+                    )
+                    for ingredient in pantry[:2]
+                ])
+        response = self.auth_client.get(url)
+        self.assertEqual(response.data['results'][0]['id'], recipe.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        response = self.auth_client.get(url)
+        self.assertNotIn(
+            recipe.pk,
+            [recipe['id'] for recipe in response.data['results']],
+        )
+        self.assertQueries(
+            self.auth_client, 'get',
+            '/api/recipes/what_can_i_cook/?ingredients=соль',
+            status.HTTP_400_BAD_REQUEST, 0,
+        )
+
+    def test_pantry_index(self):
+        index = PantryIndex()
+        pantry = [ingredient.pk for ingredient in self.ingredients[:3]]
+        matches = index.match(pantry)
+        everything = matches[:len(matches)]
+        self.assertEqual(
+            everything,
+            sorted(everything, key=lambda match: (
+                -match.coverage, len(match.missing), -match.recipe_id,
+            )),
+        )
+        self.assertEqual(matches[2:5], everything[2:5])
+        self.assertEqual(matches[0], everything[0])
+
+        # пока другой поток собирает новый снимок, читается старый
+        snapshot = index.snapshot
+        with self.captureOnCommitCallbacks(execute=True):
+            index.record_change(self.recipes[0].pk)
+        with index._lock, self.assertNumQueries(0):
+            self.assertIs(index.sync(), snapshot)
+        self.assertIsNot(index.sync(), snapshot)
+        self.assertEqual(index.snapshot.recipes, snapshot.recipes)
+
+    def test_recipe_list_user_filters(self):
+        Favorite.objects.create(user=self.user, recipe=self.other_recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.other_recipe)
+        self.assertQueries(
+            self.auth_client, 'get', '/api/recipes/?is_favorited=1',
+            status.HTTP_200_OK, 6,
+        )
+        self.assertQueries(
+            self.auth_client, 'get', '/api/recipes/?is_in_shopping_cart=1',
+            status.HTTP_200_OK, 4,
+        )
+
+    def test_viewer_state(self):
+        Favorite.objects.create(user=self.user, recipe=self.other_recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.own_recipe)
+        url = (
+            f'/api/recipes/state/?ids={self.other_recipe.pk},'
+            f'{self.own_recipe.pk}&ids=0'
+        )
+        response = self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_200_OK, 3,
+        )
+        followed = self.user.subscribed_to.filter(
+            author=self.other_recipe.author
+        ).exists()
+        self.assertEqual(
+            {row['id']: row for row in response.data},
+            {
+                self.other_recipe.pk: {
+                    'id': self.other_recipe.pk,
+                    'is_favorited': True,
+                    'is_in_shopping_cart': False,
+                    'is_subscribed': followed,
+                },
+                self.own_recipe.pk: {
+                    'id': self.own_recipe.pk,
+                    'is_favorited': False,
+                    'is_in_shopping_cart': True,
+                    'is_subscribed': False,
+                },
+            },
+        )
+        # множества пользователя уже в памяти процесса
+        self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_200_OK, 1,
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(user=self.user).delete()
+        response = self.auth_client.get(url)
+        self.assertFalse(
+            any(row['is_favorited'] for row in response.data)
+        )
+        response = self.assertQueries(
+            self.anon_client, 'get', url, status.HTTP_200_OK, 1,
+        )
+        self.assertFalse(any(
+            row['is_in_shopping_cart'] for row in response.data
+        ))
+        self.assertQueries(
+            self.anon_client, 'get', '/api/recipes/state/?ids=1,x',
+            status.HTTP_400_BAD_REQUEST, 0,
+        )
+        self.assertQueries(
+            self.anon_client, 'get',
+            '/api/recipes/state/?ids=' + ','.join(map(str, range(101))),
+            status.HTTP_400_BAD_REQUEST, 0,
+        )
+
+    def test_anonymous_response_cache(self):
+        other_author = self.other_recipe.author
+        own_url = f'/api/recipes/?author={self.user.pk}&page=1'
+        other_url = f'/api/recipes/?page=1&author={other_author.pk}'
+        detail_url = f'/api/recipes/{self.own_recipe.pk}/'
+        tag = Tag.objects.exclude(recipes=self.other_recipe).first()
+        tag_url = f'/api/recipes/?tags={tag.slug}'
+        urls = ('/api/recipes/', own_url, other_url, detail_url, tag_url)
+        for url in urls:
+            response = self.anon_client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+        for url in urls:
+            with self.assertNumQueries(0):
+                response = self.anon_client.get(url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+        # порядок параметров не важен
+        with self.assertNumQueries(0):
+            self.anon_client.get(
+                f'/api/recipes/?page=1&author={self.user.pk}'
+            )
+        self.assertNotIn(
+            'X-Cache', self.auth_client.get('/api/recipes/')
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.own_recipe.name = 'Новое название'
+            self.own_recipe.image_derivatives = {
+                'source': self.own_recipe.image.name,
+            }
+            self.own_recipe.save()
+        response = self.anon_client.get(detail_url)
+        self.assertEqual(response.data['name'], 'Новое название')
+        for url, cached in (
+            ('/api/recipes/', False),
+            (own_url, False),
+            (other_url, True),
+            (tag_url, tag not in self.own_recipe.tags.all()),
+        ):
+            self.assertEqual(
+                self.anon_client.get(url)['X-Cache'] == 'HIT', cached, url
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other_recipe.tags.add(tag)
+        self.assertEqual(self.anon_client.get(tag_url)['X-Cache'], 'MISS')
+        self.assertEqual(self.anon_client.get(other_url)['X-Cache'], 'HIT')
+
+        # профиль автора встроен в ответы с его рецептами
+        other_detail_url = f'/api/recipes/{self.other_recipe.pk}/'
+        for url in urls + (other_detail_url,):
+            self.anon_client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+        for url in urls:
+            self.assertEqual(self.anon_client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Переименованный'
+            self.user.save()
+        response = self.anon_client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(
+            response.data['author']['first_name'], 'Переименованный'
+        )
+        for url, cached in (
+            ('/api/recipes/', False),
+            (own_url, False),
+            (other_url, True),
+            (other_detail_url, True),
+        ):
+            self.assertEqual(
+                self.anon_client.get(url)['X-Cache'] == 'HIT', cached, url
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'Второй завтрак'
+            tag.save()
+        for url in urls:
+            self.assertEqual(self.anon_client.get(url)['X-Cache'], 'MISS')
+
+    def test_recipe_detail(self):
+        self.assertQueries(
+            self.anon_client, 'get', f'/api/recipes/{self.other_recipe.pk}/',
+            status.HTTP_200_OK, 3,
+        )
+        self.assertQueries(
+            self.auth_client, 'get', f'/api/recipes/{self.other_recipe.pk}/',
+            status.HTTP_200_OK, 5,
+        )
+
+    def test_recipe_create(self):
+        data = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 5}
+                for ingredient in self.ingredients[:10]
+            ],
+        }
+        response = self.assertQueries(
+            self.auth_client, 'post', '/api/recipes/',
+            status.HTTP_201_CREATED, 17, data,
+        )
+        # тот же набор полей, что в списке, без служебных полей модели:
+        # копии иллюстрации - только ссылками в images
+        self.assertEqual(
+            set(response.data), set(RecipeListSerializer.Meta.fields),
+        )
+        self.assertFalse(response.data['is_favorited'])
+
+    @override_settings(BACKGROUND_WORKERS=0)
+    def test_recipe_image_pipeline(self):
+        data = {
+            'name': 'Рецепт с картинкой',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.auth_client.post('/api/recipes/', data, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            second = self.auth_client.post(
+                '/api/recipes/', data, format='json'
+            )
+        # копии в ответе на изменение - только ссылками
+        response = self.auth_client.patch(
+            f'/api/recipes/{first.data["id"]}/', {'cooking_time': 15},
+            format='json',
+        )
+        self.assertNotIn('image_derivatives', response.data)
+        self.assertEqual(
+            set(response.data['images']), {'thumbnail', 'card', 'full'}
+        )
+        self.assertTrue(
+            response.data['images']['card']['webp'].startswith('http')
+        )
+        first = Recipe.objects.get(pk=first.data['id'])
+        second = Recipe.objects.get(pk=second.data['id'])
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_derivatives, second.image_derivatives)
+        response = self.anon_client.get(f'/api/recipes/{first.pk}/')
+        self.assertEqual(
+            set(response.data['images']), {'thumbnail', 'card', 'full'}
+        )
+        self.assertIn('webp', response.data['images']['thumbnail'])
+        data['image'] = 'data:image/png;base64,не base64'
+        response = self.auth_client.post('/api/recipes/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+    def test_recipe_image_limits(self):
+        data = {
+            'name': 'Рецепт с картинкой',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].pk],
+            'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+        }
+        for limits, code in (
+            ({'RECIPE_IMAGE_MAX_SIZE': 10}, 'too_large'),
+            ({'RECIPE_IMAGE_MAX_PIXELS': 0}, 'too_many_pixels'),
+        ):
+            with self.subTest(code), override_settings(**limits):
+                response = self.auth_client.post(
+                    '/api/recipes/', data, format='json'
+                )
+                self.assertEqual(
+                    response.status_code, status.HTTP_400_BAD_REQUEST
+                )
+                self.assertEqual(response.data['image'][0].code, code)
+
+    def test_recipe_ingredients_validation(self):
+        data = {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].pk],
+            'ingredients': [
+                {'id': self.ingredients[0].pk, 'amount': 2},
+                {'id': self.ingredients[0].pk, 'amount': 3},
+            ],
+        }
+        self.assertQueries(
+            self.auth_client, 'post', '/api/recipes/',
+            status.HTTP_400_BAD_REQUEST, 2, data,
+        )
+        data['ingredients'] = [
+            {'id': ingredient.pk, 'amount': 1}
+            for ingredient in self.ingredients[:50]
+        ] + [{'id': 10 ** 6, 'amount': 1}, {'id': 10 ** 6 + 1, 'amount': 1}]
+        response = self.assertQueries(
+            self.auth_client, 'post', '/api/recipes/',
+            status.HTTP_400_BAD_REQUEST, 2, data,
+        )
+        self.assertIn(
+            f'{[10 ** 6, 10 ** 6 + 1]}', str(response.data['ingredients'])
+        )
+
+    def test_recipe_update(self):
+        data = {
+            'name': 'Новое название',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [self.tags[0].pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 7}
+                for ingredient in self.ingredients[:10]
+            ],
+        }
+        self.assertQueries(
+            self.auth_client, 'put', f'/api/recipes/{self.own_recipe.pk}/',
+            status.HTTP_200_OK, 19, data,
+        )
+
+    def test_recipe_partial_update(self):
+        url = f'/api/recipes/{self.own_recipe.pk}/'
+        rows = set(
+            self.own_recipe.ingredient_amount.values_list('pk', 'amount')
+        )
+        self.assertQueries(
+            self.auth_client, 'patch', url,
+            status.HTTP_200_OK, 10, {'name': 'Новое название'},
+        )
+        self.assertEqual(
+            set(self.own_recipe.ingredient_amount.values_list(
+                'pk', 'amount'
+            )),
+            rows,
+        )
+        data = {
+            'ingredients': [
+                {'id': row.ingredient_id, 'amount': row.amount + 1}
+                for row in self.own_recipe.ingredient_amount.all()[:2]
+            ],
+        }
+        self.assertQueries(
+            self.auth_client, 'patch', url, status.HTTP_200_OK, 14, data,
+        )
+        self.assertEqual(self.own_recipe.ingredient_amount.count(), 2)
+
+    def test_recipe_delete(self):
+        self.assertQueries(
+            self.auth_client, 'delete', f'/api/recipes/{self.own_recipe.pk}/',
+            status.HTTP_204_NO_CONTENT, 16,
+        )
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.other_recipe.pk}/favorite/'
+        favorites_count = self.other_recipe.favorites_count
+        self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_201_CREATED, 8
+        )
+        self.other_recipe.refresh_from_db()
+        self.assertEqual(
+            self.other_recipe.favorites_count, favorites_count + 1
+        )
+        self.assertQueries(
+            self.auth_client, 'delete', url, status.HTTP_204_NO_CONTENT, 6
+        )
+        self.other_recipe.refresh_from_db()
+        self.assertEqual(self.other_recipe.favorites_count, favorites_count)
+
+    def test_counters_outside_views(self):
+        recipe = Recipe.objects.create(
+            name='Из админки', author=self.user, text='Описание',
+            image='recipes/images/test.png', cooking_time=5,
+            image_derivatives={'source': 'recipes/images/test.png'},
+        )
+        Favorite.objects.create(user=self.users[1], recipe=recipe)
+        # избранное в обход сигналов: счетчик отстает от COUNT
+        Favorite.objects.bulk_create([Favorite(user=self.user, recipe=recipe)])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+        url = f'/api/recipes/{recipe.pk}/favorite/'
+        auth_client = APIClient()
+        auth_client.force_authenticate(self.users[1])
+        for client in (auth_client, self.auth_client):
+            response = client.delete(url)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+        recipes_count = User.objects.get(pk=self.user.pk).recipes_count
+        User.objects.filter(pk=self.user.pk).update(recipes_count=0)
+        response = self.auth_client.delete(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(User.objects.get(pk=self.user.pk).recipes_count, 0)
+        self.assertGreater(recipes_count, 0)
+
+    def test_reconcile_counters(self):
+        Recipe.objects.filter(pk=self.own_recipe.pk).update(
+            favorites_count=5
+        )
+        User.objects.filter(pk=self.user.pk).update(
+            recipes_count=0, followers_count=100
+        )
+        out = StringIO()
+        call_command('reconcile_counters', batch_size=7, stdout=out)
+        self.assertIn('исправлено 1', out.getvalue())
+        self.own_recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.own_recipe.favorites_count, 0)
+        self.assertEqual(self.user.recipes_count, RECIPES_PER_AUTHOR)
+        self.assertEqual(
+            self.user.followers_count,
+            Follow.objects.filter(author=self.user).count(),
+        )
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.other_recipe.pk}/shopping_cart/'
+        self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_201_CREATED, 9
+        )
+        self.assertQueries(
+            self.auth_client, 'delete', url, status.HTTP_204_NO_CONTENT, 8
+        )
+
+    def test_download_shopping_cart(self):
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes[:100]
+        ])
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        url = '/api/recipes/download_shopping_cart/'
+        # токен уже в кеше: остается только запрос списка покупок
+        self.auth_client.get('/api/users/me/')
+        for export_format, content_type in (
+            ('txt', 'text/plain; charset=utf-8'),
+            ('csv', 'text/csv; charset=utf-8'),
+            ('json', 'application/json'),
+            ('pdf', 'application/pdf'),
+        ):
+            with self.subTest(export_format=export_format):
+                with self.assertNumQueries(1):
+                    response = self.auth_client.get(
+                        url, {'format': export_format}
+                    )
+                    content = b''.join(response.streaming_content)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['Content-Type'], content_type)
+                self.assertIn(
+                    f'filename="foodgram_shopping_cart.{export_format}"',
+                    response['Content-Disposition'],
+                )
+                self.assertTrue(content)
+
+    def test_pdf_items_limit(self):
+        items = [{'name': 'соль', 'units': 'г', 'total': 1}] * 1000
+        with override_settings(SHOPPING_CART_PDF_MAX_ITEMS=100):
+            pdf = b''.join(stream_pdf(iter(items)))
+        # 100 позиций и строка о том, что список обрезан: три страницы
+        self.assertIn(b'/Count 3', pdf)
+
+    def test_download_shopping_cart_asgi(self):
+        ShoppingCart.objects.bulk_create([
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes[:3]
+        ])
+        call_command('rebuild_shopping_lists', stdout=StringIO())
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/recipes/download_shopping_cart/',
+            'query_string': b'format=csv',
+            'headers': [
+                (b'authorization', f'Token {self.token}'.encode()),
+            ],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # как тестовый клиент: соединение с базой принадлежит тесту
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        self.assertEqual(messages[0]['status'], status.HTTP_200_OK)
+        headers = dict(messages[0]['headers'])
+        self.assertEqual(
+            headers[b'Content-Type'], b'text/csv; charset=utf-8'
+        )
+        self.assertIn(b'attachment', headers[b'Content-Disposition'])
+        content = b''.join(
+            message.get('body', b'') for message in messages[1:]
+        ).decode()
+        self.assertEqual(
+            content.splitlines()[1:],
+            [
+                f'{item.ingredient.name},'
+                f'{item.ingredient.measurement_unit},{item.total}'
+                for item in ShoppingListItem.objects.filter(
+                    user=self.user,
+                ).select_related('ingredient').order_by(
+                    '-total', 'ingredient__name',
+                )
+            ],
+        )
+
+
+class ShoppingListTest(QueryCountTestCase):
+    """
+    Итоги списка покупок совпадают с пересчетом с нуля
+    """
+
+    def totals(self):
+        return dict(
+            ShoppingListItem.objects.filter(
+                user=self.user
+            ).values_list('ingredient_id', 'total')
+        )
+
+    def rebuilt_totals(self):
+        ShoppingListItem.objects.rebuild([self.user.pk])
+        return self.totals()
+
+    def test_incremental_totals(self):
+        own_recipe = self.user.recipes.first()
+        for recipe in (own_recipe, *self.recipes[20:25]):
+            self.auth_client.get(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertEqual(self.totals(), self.rebuilt_totals())
+
+        self.auth_client.patch(
+            f'/api/recipes/{own_recipe.pk}/',
+            {
+                'ingredients': [
+                    {'id': self.ingredients[0].pk, 'amount': 100},
+                    {'id': self.ingredients[99].pk, 'amount': 3},
+                ],
+            },
+            format='json',
+        )
+        self.assertEqual(self.totals(), self.rebuilt_totals())
+
+        self.auth_client.delete(
+            f'/api/recipes/{self.recipes[20].pk}/shopping_cart/'
+        )
+        self.assertEqual(self.totals(), self.rebuilt_totals())
+
+        self.auth_client.delete(f'/api/recipes/{own_recipe.pk}/')
+        self.assertEqual(self.totals(), self.rebuilt_totals())
+
+    def test_apply_deltas_upsert(self):
+        first, second, third = (
+            ingredient.pk for ingredient in self.ingredients[:3]
+        )
+        # строку успел создать параллельный запрос
+        ShoppingListItem.objects.create(
+            user=self.user, ingredient_id=first, total=5
+        )
+        ShoppingListItem.objects.create(
+            user=self.user, ingredient_id=third, total=2
+        )
+        with self.assertNumQueries(3):
+            ShoppingListItem.objects.apply_deltas(
+                [self.user.pk], {first: 3, second: 4, third: -5},
+            )
+        self.assertEqual(self.totals(), {first: 8, second: 4})
+
+
+class LoadIngredientsTest(APITestCase):
+    """
+    Загрузка ингредиентов из CSV и JSON без дубликатов
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def load(self, path, **options):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_ingredients', path, stdout=out, **options)
+        return out.getvalue()
+
+    def ingredients(self):
+        return set(
+            Ingredient.objects.values_list('name', 'measurement_unit')
+        )
+
+    def test_csv(self):
+        path = self.write(
+            'ingredients.csv',
+            'мука,г\n сахар , г\nмука,г\nмука,кг\n,г\nбез единицы\n',
+        )
+        self.assertIn('добавлено ингредиентов: 3', self.load(path))
+        expected = {('мука', 'г'), ('сахар', 'г'), ('мука', 'кг')}
+        self.assertEqual(self.ingredients(), expected)
+        self.assertIn('добавлено ингредиентов: 0', self.load(path))
+        self.assertEqual(self.ingredients(), expected)
+
+    def test_json(self):
+        items = [
+            {'name': f'ингредиент {number}', 'measurement_unit': 'г'}
+            for number in range(30)
+        ]
+        path = self.write(
+            'ingredients.data',
+            json.dumps(items + items[:5], ensure_ascii=False, indent=1),
+        )
+        # маленький буфер: объекты разрезаются между чтениями файла
+        with mock.patch.object(load_ingredients, 'READ_CHUNK_SIZE', 16):
+            self.assertIn(
+                'добавлено ингредиентов: 30',
+                self.load(path, format='json', batch_size=7),
+            )
+            self.assertIn(
+                'добавлено ингредиентов: 0', self.load(path, format='json'),
+            )
+        self.assertEqual(len(self.ingredients()), 30)
+
+        broken = self.write('broken.json', '[{"name": "мука", "measure')
+        with self.assertRaises(CommandError):
+            self.load(broken)
+
+    def test_invalidates_ingredient_cache(self):
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(len(response.data), 1)
+        self.load(self.write('ingredients.csv', 'мука,г\nсоль,г\n'))
+        response = self.client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {row['name'] for row in response.data}, {'мука', 'соль'}
+        )
+
+
+class DedupeIngredientsTest(QueryCountTestCase):
+    """
+    Слияние дубликатов ингредиентов командой и миграцией 0006
+    """
+
+    def setUp(self):
+        super().setUp()
+        # дубликаты можно вставить только без уникального индекса,
+        # DDL откатится вместе с транзакцией теста
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'ALTER TABLE recipes_ingredient '
+                    'DROP CONSTRAINT unique_ingredient'
+                )
+            else:
+                cursor.execute('DROP INDEX unique_ingredient')
+        self.original = self.ingredients[0]
+        Ingredient.objects.bulk_create([
+            Ingredient(
+                name=self.original.name,
+                measurement_unit=self.original.measurement_unit,
+            )
+            for _ in range(2)
+        ])
+        self.copies = list(Ingredient.objects.filter(
+            name=self.original.name,
+        ).exclude(pk=self.original.pk))
+        self.recipe = Recipe.objects.exclude(
+            ingredients=self.original
+        ).first()
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=self.recipe, ingredient=copy, amount=number + 1,
+            )
+            for number, copy in enumerate(self.copies)
+        ])
+        ShoppingListItem.objects.bulk_create([
+            ShoppingListItem(
+                user=self.user, ingredient=self.original, total=10,
+            ),
+            ShoppingListItem(
+                user=self.user, ingredient=self.copies[0], total=5,
+            ),
+            ShoppingListItem(
+                user=self.users[1], ingredient=self.copies[1], total=7,
+            ),
+        ])
+
+    def assertMerged(self):
+        self.assertFalse(
+            Ingredient.objects.filter(
+                pk__in=[copy.pk for copy in self.copies]
+            ).exists()
+        )
+        self.assertEqual(
+            Ingredient.objects.filter(name=self.original.name).count(), 1
+        )
+        self.assertEqual(
+            IngredientInRecipe.objects.get(
+                recipe=self.recipe, ingredient=self.original,
+            ).amount,
+            3,
+        )
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                ingredient=self.original,
+            ).values_list('user_id', 'total')),
+            {self.user.pk: 15, self.users[1].pk: 7},
+        )
+
+    def test_command(self):
+        out = StringIO()
+        call_command('dedupe_ingredients', stdout=out)
+        self.assertIn('Удалено дубликатов ингредиентов: 2', out.getvalue())
+        self.assertMerged()
+        out = StringIO()
+        call_command('dedupe_ingredients', stdout=out)
+        self.assertIn('Удалено дубликатов ингредиентов: 0', out.getvalue())
+
+    def test_migration(self):
+        migration = import_module(
+            'recipes.migrations.0006_ingredient_unique_name'
+        )
+        migration.merge_duplicates(django_apps, None)
+        self.assertMerged()
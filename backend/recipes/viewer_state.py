@@ -0,0 +1,86 @@
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import IntegerField, Value
+
+from foodgram_project.versions import bump_version, get_version
+
+ViewerState = namedtuple('ViewerState', 'favorites shopping_cart following')
+
+EMPTY_STATE = ViewerState(frozenset(), frozenset(), frozenset())
+
+FAVORITE, SHOPPING_CART, FOLLOWING = range(3)
+
+
+class ViewerStateCache:
+    """
+    Множества id избранного, корзины и авторов из подписок каждого
+    пользователя в памяти процесса, не больше max_size пользователей.
+    версия пользователя хранится в общем кеше Django, как у справочников
+    """
+
+    def __init__(self):
+        self._states = OrderedDict()
+        self._lock = Lock()
+
+    def version_key(self, user_id):
+        return f'viewer:{user_id}:version'
+
+    def load(self, user_id):
+        """
+        Все три множества одним запросом UNION ALL
+        """
+        def rows(model, kind, field):
+            return model.objects.filter(user_id=user_id).annotate(
+                kind=Value(kind, output_field=IntegerField()),
+            ).values_list('kind', field).order_by()
+
+        ids = ([], [], [])
+        for kind, pk in rows(
+            apps.get_model('recipes', 'Favorite'), FAVORITE, 'recipe_id',
+        ).union(
+            rows(
+                apps.get_model('recipes', 'ShoppingCart'),
+                SHOPPING_CART, 'recipe_id',
+            ),
+            rows(apps.get_model('users', 'Follow'), FOLLOWING, 'author_id'),
+            all=True,
+        ):
+            ids[kind].append(pk)
+        return ViewerState(*map(frozenset, ids))
+
+    def get(self, user_id) -> ViewerState:
+        version = get_version(self.version_key(user_id))
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is not None and entry[0] == version:
+                self._states.move_to_end(user_id)
+                return entry[1]
+        state = self.load(user_id)
+        with self._lock:
+            self._states[user_id] = (version, state)
+            self._states.move_to_end(user_id)
+            while len(self._states) > settings.VIEWER_STATE_CACHE_SIZE:
+                self._states.popitem(last=False)
+        return state
+
+    def invalidate(self, user_id):
+        bump_version(self.version_key(user_id))
+
+
+viewer_state_cache = ViewerStateCache()
+
+
+def get_viewer_state(request):
+    """
+    Состояние текущего пользователя, один раз на запрос
+    """
+    if request is None or not request.user.is_authenticated:
+        return EMPTY_STATE
+    state = getattr(request, '_viewer_state', None)
+    if state is None:
+        state = viewer_state_cache.get(request.user.pk)
+        request._viewer_state = state
+    return state
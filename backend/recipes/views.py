@@ -1,25 +1,135 @@
+from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
 from django.db.models import F, Sum
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters import rest_framework as my_filters
 from rest_framework import status, views, viewsets
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from .cache import ingredient_cache, tag_cache
+from .exporters import (EXPORTERS, CSVRenderer, PDFRenderer,
+                        PlainTextRenderer, spool)
 from .filters import IngredientFilter, RecipeFilter
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .pagination import (ApproximateCountPagination, FeedPagination,
+                         RecipePagination)
+from .pantry import pantry_index
 from .permissions import OwnerOrAdminOrReadOnly
+from .response_cache import (ALL, author_scope, recipe_scope, response_cache,
+                             tag_scope)
 from .serializers import (FavoriteSerializer, IngredientSerializer,
+                          PantryRecipeSerializer,
                           RecipeCreateUpdateSerializer, RecipeListSerializer,
                           ShoppingCartSerializer, TagSerializer)
+from .viewer_state import get_viewer_state
 
+User = get_user_model()
 
-class TagViewSet(viewsets.ModelViewSet):
+
+def id_list(request, name, max_length=None):
+    """
+    Множество id из параметра ?name=1,2,3 (можно повторять параметр)
+    """
+    values = ','.join(request.query_params.getlist(name))
+    try:
+        ids = {int(value) for value in values.split(',') if value.strip()}
+    except ValueError:
+        raise ValidationError({name: 'Ожидаются id через запятую.'})
+    if max_length is not None and len(ids) > max_length:
+        raise ValidationError({name: f'Не больше {max_length} id.'})
+    return ids
+
+
+class ReferenceCacheMixin:
+    """
+    Отдает справочник из кеша в памяти процесса.
+    ETag считается по содержимому снимка, на If-None-Match отвечает 304
+    """
+    reference_cache = None
+
+    def not_modified(self, request, snapshot):
+        if request.META.get('HTTP_IF_NONE_MATCH') == snapshot.etag:
+            return Response(
+                status=status.HTTP_304_NOT_MODIFIED,
+                headers={'ETag': snapshot.etag},
+            )
+        return None
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.reference_cache.snapshot()
+        response = self.not_modified(request, snapshot)
+        if response is not None:
+            return response
+        if request.query_params:
+            response = super().list(request, *args, **kwargs)
+        else:
+            response = Response(snapshot.rows)
+        response['ETag'] = snapshot.etag
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = self.reference_cache.snapshot()
+        response = self.not_modified(request, snapshot)
+        if response is not None:
+            return response
+        try:
+            row = snapshot.by_pk.get(int(kwargs[self.lookup_field]))
+        except ValueError:
+            row = None
+        if row is None:
+            raise Http404
+        return Response(row, headers={'ETag': snapshot.etag})
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Отдает анонимным пользователям list и retrieve из общего кеша.
+    get_response_cache_scopes возвращает области, от которых зависит
+    ответ, или None, если ответ кешировать нельзя. по умолчанию
+    ничего не кешируется
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def get_response_cache_scopes(self):
+        return None
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        scopes = None
+        if self.action in self.cached_actions and request.user.is_anonymous:
+            scopes = self.get_response_cache_scopes()
+        if scopes is None:
+            return handler(request, *args, **kwargs)
+        key = response_cache.key(request, scopes)
+        data = response_cache.get(key)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response_cache.set(key, response.data)
+            response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class TagViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """
     Вьюсет тегов
     """
+    reference_cache = tag_cache
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
@@ -27,10 +137,11 @@ class TagViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ModelViewSet):
     """
     Вьюсет ингирдиентов
     """
+    reference_cache = ingredient_cache
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
@@ -38,31 +149,119 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filterset_class = IngredientFilter
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(AnonymousResponseCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     http_method_names = ['get', 'post', 'put', 'delete', 'patch']
     filter_backends = (my_filters.DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = PageNumberPagination
+    pagination_class = RecipePagination
     permission_classes = (OwnerOrAdminOrReadOnly,)
+    max_state_ids = 100
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.remove_recipe(
+            instance.pk,
+            instance.shopping_cart.values_list('user_id', flat=True),
+        )
+        instance.delete()
+
+    def get_response_cache_scopes(self):
+        if self.action == 'retrieve':
+            pk = self.kwargs[self.lookup_field]
+            return [recipe_scope(pk)] if pk.isdigit() else None
+        params = self.request.query_params
+        filters = set(params) - {'page', 'limit', 'cursor'}
+        if filters and filters <= {'author', 'tags'}:
+            if 'author' in filters:
+                author = params['author']
+                return [author_scope(author)] if author.isdigit() else None
+            tag_ids = {
+                row['slug']: row['id'] for row in tag_cache.snapshot().rows
+            }
+            slugs = params.getlist('tags')
+            if not all(slug in tag_ids for slug in slugs):
+                return None
+            return [tag_scope(tag_ids[slug]) for slug in slugs]
+        return [ALL]
+
     def get_serializer_class(self):
         if self.action in ('create', 'update', 'partial_update'):
             return RecipeCreateUpdateSerializer
+        if self.action == 'what_can_i_cook':
+            return PantryRecipeSerializer
         return RecipeListSerializer
 
-    def get_queryset(self):
-        queryset = Recipe.objects
-        user = self.request.user
-        queryset = queryset.add_user_annotation(user.pk)
-        if self.request.query_params.get('is_favorited'):
-            queryset = queryset.filter(is_favorited=True)
-        if self.request.query_params.get('is_in_shopping_cart'):
-            queryset = queryset.filter(is_in_shopping_cart=True)
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request, *args, **kwargs):
+        """
+        Лента рецептов авторов из подписок, постранично по курсору
+        """
+        return self.list(request, *args, **kwargs)
+
+    @action(
+        detail=False,
+        url_path='what_can_i_cook',
+        pagination_class=ApproximateCountPagination,
+    )
+    def what_can_i_cook(self, request):
+        """
+        Рецепты из продуктов ?ingredients=1,2,3 - от рецептов, для которых
+        есть большая доля ингредиентов, с перечнем недостающих
+        """
+        ingredient_ids = id_list(request, 'ingredients')
+        page = self.paginate_queryset(pantry_index.match(ingredient_ids))
+        recipes = self.get_queryset().in_bulk(
+            [match.recipe_id for match in page]
+        )
+        ingredients = ingredient_cache.snapshot().by_pk
+        results = []
+        for match in page:
+            recipe = recipes.get(match.recipe_id)
+            if recipe is None:
+                continue
+            recipe.coverage = match.coverage
+            recipe.missing_ingredients = [
+                ingredients[pk] for pk in match.missing if pk in ingredients
+            ]
+            results.append(recipe)
+        serializer = self.get_serializer(results, many=True)
+        return self.get_paginated_response(serializer.data)
 
+    @action(detail=False, pagination_class=None)
+    def state(self, request):
+        """
+        Флаги текущего пользователя для рецептов ?ids=1,2,3:
+        сами списки рецептов от пользователя не зависят
+        """
+        recipe_ids = id_list(request, 'ids', self.max_state_ids)
+        state = get_viewer_state(request)
+        recipes = Recipe.objects.filter(pk__in=recipe_ids).values_list(
+            'pk', 'author_id',
+        ).order_by('-pub_date', '-id')
+        return Response([
+            {
+                'id': recipe_id,
+                'is_favorited': recipe_id in state.favorites,
+                'is_in_shopping_cart': recipe_id in state.shopping_cart,
+                'is_subscribed': author_id in state.following,
+            }
+            for recipe_id, author_id in recipes
+        ])
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve', 'feed', 'what_can_i_cook'):
+            queryset = Recipe.objects.for_listing()
+        else:
+            queryset = Recipe.objects.all()
         return queryset
 
 
@@ -87,7 +286,8 @@ class FavoriteView(views.APIView):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -96,7 +296,8 @@ class FavoriteView(views.APIView):
     def delete(self, request, pk):
         user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        Favorite.objects.filter(user=user, recipe=recipe).delete()
+        with transaction.atomic():
+            Favorite.objects.filter(user=user, recipe=recipe).delete()
         return Response(
             status=status.HTTP_204_NO_CONTENT
         )
@@ -124,7 +325,9 @@ class ShoppingCartView(views.APIView):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
-        serializer.save()
+        with transaction.atomic():
+            cart = serializer.save()
+            ShoppingListItem.objects.add_recipe(cart.recipe_id, [user.id])
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -133,40 +336,66 @@ class ShoppingCartView(views.APIView):
     def delete(self, request, pk):
         user = request.user
         recipe = get_object_or_404(Recipe, pk=pk)
-        ShoppingCart.objects.filter(user=user, recipe=recipe).delete()
+        with transaction.atomic():
+            deleted, _ = ShoppingCart.objects.filter(
+                user=user, recipe=recipe
+            ).delete()
+            if deleted:
+                ShoppingListItem.objects.remove_recipe(recipe.pk, [user.id])
         return Response(
             status=status.HTTP_204_NO_CONTENT
         )
 
 
 class DownloadShoppingCartView(views.APIView):
+    """
+    Вью выгрузки списка покупок.
+    формат задается параметром ?format=txt|csv|pdf|json,
+    txt, csv и json отдаются потоком по мере чтения курсора, pdf -
+    после сборки. под ASGI - из временного файла, собранного во вью
+    """
+    renderer_classes = (
+        PlainTextRenderer, CSVRenderer, PDFRenderer, JSONRenderer,
+    )
+    chunk_size = 500
+
     def get(self, request):
-        items = IngredientInRecipe.objects.select_related(
-            'recipe', 'ingredient'
-        )
         if request.user.is_authenticated:
-            items = items.filter(
-                recipe__shopping_cart__user=request.user
-            )
+            items = ShoppingListItem.objects.filter(
+                user=request.user
+            ).values(
+                'total',
+                name=F('ingredient__name'),
+                units=F('ingredient__measurement_unit'),
+            ).order_by('-total', 'name')
         else:
-            items = items.filter(
-                recipe_id__in=request.session['purchases']
-            )
+            items = IngredientInRecipe.objects.filter(
+                recipe_id__in=request.session.get('purchases', [])
+            ).values(
+                name=F('ingredient__name'),
+                units=F('ingredient__measurement_unit'),
+            ).annotate(
+                total=Sum('amount'),
+            ).order_by('-total', 'name')
 
-        items = items.values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            name=F('ingredient__name'),
-            units=F('ingredient__measurement_unit'),
-            total=Sum('amount'),
-        ).order_by('-total')
-
-        text = '\n'.join([
-            f"{item['name']} ({item['units']}) - {item['total']}"
-            for item in items
-        ])
-        filename = "foodgram_shopping_cart.txt"
-        response = HttpResponse(text, content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename{filename}'
+        renderer = request.accepted_renderer
+        filename = f'foodgram_shopping_cart.{renderer.format}'
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        chunks = EXPORTERS[renderer.format](
+            items.iterator(chunk_size=self.chunk_size)
+        )
+        if isinstance(request._request, ASGIRequest):
+            return FileResponse(
+                spool(chunks, renderer.charset),
+                as_attachment=True,
+                filename=filename,
+                content_type=content_type,
+            )
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="{filename}"'
+        )
 
         return response
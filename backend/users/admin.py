@@ -14,6 +14,8 @@ class UserAdmin(ModelAdmin):
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
+        'followers_count',
     )
     list_filter = (
         'email',
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+
+from foodgram_project.versions import bump_version, get_version
+
+
+def field_values(instance):
+    fields = instance._meta.concrete_fields
+    return (
+        tuple(field.attname for field in fields),
+        tuple(getattr(instance, field.attname) for field in fields),
+    )
+
+
+class TokenCache:
+    """
+    Токен -> пользователь в памяти процесса, не больше TOKEN_CACHE_SIZE
+    токенов и не дольше TOKEN_CACHE_TIMEOUT секунд.
+    версия пользователя хранится в общем кеше Django: выход и изменение
+    пользователя (в том числе блокировка) сбрасывают его токен
+    во всех воркерах, если кеш Django общий (проверка users.E001).
+    хранятся значения полей, а объекты собираются заново на каждый
+    запрос, чтобы запросы не делили один request.user
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version_key(self, user_id):
+        return f'auth:user:{user_id}:version'
+
+    def get(self, key):
+        """
+        (user, token) из кеша или None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            user_id, version, expires, user_row, token_row = entry
+            if (
+                expires > time.monotonic()
+                and version == get_version(self.version_key(user_id))
+            ):
+                with self._lock:
+                    self.hits += 1
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                return self.build(user_row, token_row)
+        with self._lock:
+            self.misses += 1
+            self._entries.pop(key, None)
+        return None
+
+    def build(self, user_row, token_row):
+        from rest_framework.authtoken.models import Token
+
+        user_model = Token._meta.get_field('user').related_model
+        user = user_model.from_db(
+            router.db_for_read(user_model), *user_row,
+        )
+        token = Token.from_db(router.db_for_read(Token), *token_row)
+        token.user = user
+        return user, token
+
+    def set(self, key, user, token):
+        entry = (
+            user.pk,
+            get_version(self.version_key(user.pk)),
+            time.monotonic() + settings.TOKEN_CACHE_TIMEOUT,
+            field_values(user),
+            field_values(token),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        bump_version(self.version_key(user_id))
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else None,
+                'size': len(self._entries),
+                'max_size': settings.TOKEN_CACHE_SIZE,
+            }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к базе на каждый запрос:
+    токены активных пользователей берутся из token_cache.
+    при TOKEN_CACHE_SIZE = 0 - обычная проверка в базе
+    """
+
+    def authenticate_credentials(self, key):
+        if not settings.TOKEN_CACHE_SIZE:
+            return super().authenticate_credentials(key)
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from rest_framework.exceptions import Throttled
+
+UserModel = get_user_model()
+
+_executor = None
+_slots = None
+_lock = Lock()
+
+
+def get_login_executor():
+    """
+    Пул потоков для хеширования паролей и семафор на число входов,
+    которые одновременно выполняются или ждут в очереди
+    """
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.LOGIN_WORKERS,
+                thread_name_prefix='users-login',
+            )
+            _slots = BoundedSemaphore(
+                settings.LOGIN_WORKERS + settings.LOGIN_QUEUE_SIZE
+            )
+    return _executor, _slots
+
+
+def run_hashing(task, *args):
+    """
+    Выполняет хеширование в пуле, при LOGIN_WORKERS = 0 - сразу.
+    когда пул и очередь заняты, вход отклоняется с 429, а не занимает
+    воркер, который мог бы отдавать рецепты
+    """
+    if not settings.LOGIN_WORKERS:
+        return task(*args)
+    executor, slots = get_login_executor()
+    if not slots.acquire(blocking=False):
+        raise Throttled(
+            wait=1, detail='Слишком много входов одновременно.',
+        )
+    try:
+        return executor.submit(task, *args).result()
+    finally:
+        slots.release()
+
+
+def verify_password(password, encoded):
+    """
+    (верен ли пароль, новый хеш или None, если пересчитывать не нужно)
+    """
+    rehashed = []
+    correct = check_password(
+        password, encoded,
+        setter=lambda raw_password: rehashed.append(
+            make_password(raw_password)
+        ),
+    )
+    return correct, rehashed[0] if rehashed else None
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend, который проверяет пароль в пуле потоков входа.
+    пользователь ищется и хеш сохраняется в потоке запроса, в пуле
+    только вычисления: хеш по старым параметрам пересчитывается там же
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # столько же работы, сколько для существующего пользователя
+            run_hashing(make_password, password)
+            return None
+        correct, rehashed = run_hashing(
+            verify_password, password, user.password,
+        )
+        if not correct or not self.user_can_authenticate(user):
+            return None
+        if rehashed is not None:
+            user.password = rehashed
+            user.save(update_fields=['password'])
+        return user
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+@register(Tags.caches, Tags.security)
+def token_cache_check(app_configs, **kwargs):
+    """
+    Кеш токенов без общего кеша Django: выход и блокировка
+    пользователя не доходят до других воркеров
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if (
+        settings.TOKEN_CACHE_SIZE
+        and backend in settings.PROCESS_LOCAL_CACHE_BACKENDS
+    ):
+        return [Error(
+            f'Кеш токенов включен, а кеш Django ({backend}) виден только '
+            'своему процессу: отозванный токен продолжит работать в других '
+            'воркерах до TOKEN_CACHE_TIMEOUT секунд.',
+            hint='Задайте общий CACHE_URL или TOKEN_CACHE_SIZE=0.',
+            id='users.E001',
+        )]
+    return []
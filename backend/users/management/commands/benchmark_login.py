@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+from users.backends import verify_password
+
+PASSWORD = 'Sup3r-secret-passw0rd'
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def logins_until(deadline, encoded):
+    logins = 0
+    while time.monotonic() < deadline:
+        verify_password(PASSWORD, encoded)
+        logins += 1
+    return logins
+
+
+class Command(BaseCommand):
+    help = (
+        'Сколько входов в секунду выдерживает проверка пароля каждым '
+        'хешером из PASSWORD_HASHERS, всего и на одно ядро'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=5,
+            help='Сколько секунд мерить каждый хешер',
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=available_cores(),
+            help='Сколько входов проверять одновременно',
+        )
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        cores = min(threads, available_cores())
+        self.stdout.write(f'Потоков: {threads}, ядер: {cores}')
+        for hasher in get_hashers():
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as error:
+                self.stdout.write(f'{hasher.algorithm:>24}: пропущен, {error}')
+                continue
+            deadline = time.monotonic() + options['seconds']
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                logins = sum(executor.map(
+                    logins_until, [deadline] * threads, [encoded] * threads,
+                ))
+            elapsed = time.monotonic() - started
+            per_second = logins / elapsed
+            self.stdout.write(
+                f'{hasher.algorithm:>24}: {per_second:8.1f} входов/с, '
+                f'{per_second / cores:8.1f} на ядро, '
+                f'{threads / per_second * 1000:7.1f} мс на вход'
+            )
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='is_popular_author',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Рецепты читаются в ленте напрямую'),
+        ),
+    ]
@@ -1,6 +1,22 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
-from django.db.models import F, Q
+from django.db.models import Exists, F, OuterRef, Q
+
+
+class UserQuerySet(models.QuerySet):
+    def with_subscription_info(self, user):
+        """
+        Авторы с флагом подписки на них user
+        """
+        return self.annotate(
+            is_subscribed=Exists(
+                Follow.objects.filter(user_id=user.pk, author=OuterRef('pk'))
+            ),
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
 
 
 class User(AbstractUser):
@@ -25,10 +41,27 @@ class User(AbstractUser):
         max_length=50,
         verbose_name="Фамилия пользователя"
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+    is_popular_author = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Рецепты читаются в ленте напрямую',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
 
+    objects = CustomUserManager()
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
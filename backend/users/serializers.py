@@ -3,6 +3,7 @@ from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 
 from recipes.models import Recipe
+from recipes.viewer_state import get_viewer_state
 from .models import Follow
 
 User = get_user_model()
@@ -35,14 +36,19 @@ class UserSerializerCustom(UserSerializer):
             'username',
             'first_name',
             'last_name',
-            'is_subscribed'
+            'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
+        read_only_fields = ('recipes_count', 'followers_count')
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request is None or request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=request.user, author=obj).exists()
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        return obj.pk in get_viewer_state(
+            self.context.get('request')
+        ).following
 
 
 class AuthTokenSerializer(serializers.Serializer):
@@ -105,24 +111,17 @@ class AddFollowSerializer(serializers.ModelSerializer):
 
 class SubscribersSerializer(serializers.ModelSerializer):
     """
-    Сериализатор листа подписчиков и удаления подписки
+    Сериализатор авторов в подписках.
+    ждет аннотации UserQuerySet.with_subscription_info
+    и заранее подгруженных рецептов
     """
     recipes = RecipeShortSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
-    is_subscribed = serializers.SerializerMethodField()
+    is_subscribed = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'recipes', 'recipes_count'
+            'is_subscribed', 'recipes', 'recipes_count', 'followers_count',
         )
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
-    def get_is_subscribed(self, user):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(user=user, author=request.user).exists()
+        read_only_fields = ('recipes_count', 'followers_count')
@@ -1 +1,288 @@
-# Create your tests here.
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+
+from foodgram_project.testing import (RECIPES_PER_AUTHOR, USERS_COUNT,
+                                      QueryCountTestCase, schema_endpoints)
+from recipes.models import Recipe
+from recipes.tests import COVERED_ENDPOINTS as RECIPES_ENDPOINTS
+
+from .authentication import token_cache
+from .backends import get_login_executor
+from .checks import token_cache_check
+from .models import Follow
+
+User = get_user_model()
+
+# Эндпоинты из docs/openapi-schema.yml, покрытые тестами этого модуля
+COVERED_ENDPOINTS = {
+    ('/api/users/', 'get'),
+    ('/api/users/', 'post'),
+    ('/api/users/{id}/', 'get'),
+    ('/api/users/me/', 'get'),
+    ('/api/users/set_password/', 'post'),
+    ('/api/users/subscriptions/', 'get'),
+    ('/api/users/{id}/subscribe/', 'get'),
+    ('/api/users/{id}/subscribe/', 'delete'),
+    ('/api/auth/token/login/', 'post'),
+    ('/api/auth/token/logout/', 'post'),
+}
+
+
+class UsersQueryCountTest(QueryCountTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.not_followed = next(
+            author for author in self.users[1:]
+            if not Follow.objects.filter(
+                user=self.user, author=author
+            ).exists()
+        )
+
+    def test_schema_endpoints_covered(self):
+        self.assertEqual(
+            schema_endpoints() - COVERED_ENDPOINTS - RECIPES_ENDPOINTS,
+            set(),
+        )
+
+    def test_user_list(self):
+        self.assertQueries(
+            self.anon_client, 'get', '/api/users/', status.HTTP_200_OK, 2
+        )
+        self.assertQueries(
+            self.auth_client, 'get', '/api/users/?page=2',
+            status.HTTP_200_OK, 4,
+        )
+        # число запросов не зависит от размера страницы: счетчики хранятся
+        # в строке пользователя, подписки берутся из состояния зрителя
+        cache.clear()
+        with mock.patch.object(
+            PageNumberPagination, 'page_size', USERS_COUNT,
+        ):
+            response = self.assertQueries(
+                self.auth_client, 'get', '/api/users/',
+                status.HTTP_200_OK, 4,
+            )
+        self.assertEqual(len(response.data['results']), USERS_COUNT)
+        self.assertTrue(any(
+            user['is_subscribed'] for user in response.data['results']
+        ))
+
+    def test_user_detail(self):
+        self.assertQueries(
+            self.auth_client, 'get', f'/api/users/{self.users[1].pk}/',
+            status.HTTP_200_OK, 3,
+        )
+
+    def test_me(self):
+        self.assertQueries(
+            self.auth_client, 'get', '/api/users/me/', status.HTTP_200_OK, 2
+        )
+
+    def test_registration(self):
+        data = {
+            'email': 'new@foodgram.ru',
+            'username': 'new_user',
+            'first_name': 'Новый',
+            'last_name': 'Пользователь',
+            'password': 'Sup3r-secret',
+        }
+        self.assertQueries(
+            self.anon_client, 'post', '/api/users/',
+            status.HTTP_201_CREATED, 5, data,
+        )
+
+    def test_set_password(self):
+        self.user.set_password('Old-passw0rd')
+        self.user.save()
+        data = {
+            'current_password': 'Old-passw0rd',
+            'new_password': 'New-passw0rd',
+        }
+        self.assertQueries(
+            self.auth_client, 'post', '/api/users/set_password/',
+            status.HTTP_204_NO_CONTENT, 2, data,
+        )
+
+    def test_login_logout(self):
+        self.user.set_password('Sup3r-secret')
+        self.user.save()
+        data = {'email': self.user.email, 'password': 'Sup3r-secret'}
+        self.assertQueries(
+            self.anon_client, 'post', '/api/auth/token/login/',
+            status.HTTP_200_OK, 2, data,
+        )
+        self.assertQueries(
+            self.auth_client, 'post', '/api/auth/token/logout/',
+            status.HTTP_204_NO_CONTENT, 2,
+        )
+
+    def test_login_rehashes_password(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.user.set_password('Sup3r-secret')
+            self.user.save()
+        data = {'email': self.user.email, 'password': 'Sup3r-secret'}
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertQueries(
+                self.anon_client, 'post', '/api/auth/token/login/',
+                status.HTTP_200_OK, 3, data,
+            )
+            self.user.refresh_from_db()
+            self.assertTrue(
+                self.user.password.startswith('pbkdf2_sha256$2000$')
+            )
+            self.assertQueries(
+                self.anon_client, 'post', '/api/auth/token/login/',
+                status.HTTP_200_OK, 2, data,
+            )
+        self.assertQueries(
+            self.anon_client, 'post', '/api/auth/token/login/',
+            status.HTTP_400_BAD_REQUEST, 1,
+            {'email': 'nobody@foodgram.ru', 'password': 'Sup3r-secret'},
+        )
+
+    def test_login_concurrency_limit(self):
+        self.user.set_password('Sup3r-secret')
+        self.user.save()
+        data = {'email': self.user.email, 'password': 'Sup3r-secret'}
+        _, slots = get_login_executor()
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            response = self.anon_client.post(
+                '/api/auth/token/login/', data, format='json'
+            )
+        finally:
+            for _ in range(taken):
+                slots.release()
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS
+        )
+        self.assertEqual(
+            self.anon_client.post(
+                '/api/auth/token/login/', data, format='json'
+            ).status_code,
+            status.HTTP_200_OK,
+        )
+
+    def test_token_cache(self):
+        url = '/api/users/me/'
+        self.assertQueries(self.auth_client, 'get', url, status.HTTP_200_OK, 2)
+        hits = token_cache.stats()['hits']
+        self.assertQueries(self.auth_client, 'get', url, status.HTTP_200_OK, 0)
+        self.assertEqual(token_cache.stats()['hits'], hits + 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_401_UNAUTHORIZED, 1
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = True
+            self.user.save()
+        self.assertQueries(self.auth_client, 'get', url, status.HTTP_200_OK, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.auth_client.post('/api/auth/token/logout/')
+        self.assertQueries(
+            self.auth_client, 'get', url, status.HTTP_401_UNAUTHORIZED, 1
+        )
+
+        admin = User.objects.create_superuser(
+            'admin@foodgram.ru', 'admin', 'Sup3r-secret',
+            first_name='Админ', last_name='Админов',
+        )
+        self.anon_client.force_authenticate(admin)
+        response = self.anon_client.get('/api/auth/token/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(response.data['misses'], 0)
+        self.anon_client.force_authenticate(self.users[1])
+        self.assertEqual(
+            self.anon_client.get('/api/auth/token/stats/').status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+    def test_token_cache_requires_shared_cache(self):
+        # в тестах кеш Django - locmem, как без CACHE_URL
+        self.assertEqual(
+            [error.id for error in token_cache_check(None)], ['users.E001']
+        )
+        with override_settings(TOKEN_CACHE_SIZE=0):
+            self.assertEqual(token_cache_check(None), [])
+            url = '/api/users/me/'
+            self.assertQueries(
+                self.auth_client, 'get', url, status.HTTP_200_OK, 2
+            )
+            self.assertQueries(
+                self.auth_client, 'get', url, status.HTTP_200_OK, 1
+            )
+
+    def test_subscriptions(self):
+        response = self.assertQueries(
+            self.auth_client, 'get', '/api/users/subscriptions/',
+            status.HTTP_200_OK, 4,
+        )
+        author = response.data['results'][0]
+        self.assertTrue(author['is_subscribed'])
+        self.assertEqual(author['recipes_count'], RECIPES_PER_AUTHOR)
+        self.assertEqual(len(author['recipes']), RECIPES_PER_AUTHOR)
+        response = self.assertQueries(
+            self.auth_client, 'get',
+            '/api/users/subscriptions/?recipes_limit=2',
+            status.HTTP_200_OK, 3,
+        )
+        for author in response.data['results']:
+            latest = Recipe.objects.filter(
+                author_id=author['id']
+            ).order_by('-pub_date', '-id').values_list('pk', flat=True)[:2]
+            self.assertEqual(
+                [recipe['id'] for recipe in author['recipes']], list(latest)
+            )
+            self.assertEqual(author['recipes_count'], RECIPES_PER_AUTHOR)
+        self.assertEqual(
+            self.auth_client.get(
+                '/api/users/subscriptions/?recipes_limit=all'
+            ).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    def test_subscriptions_empty(self):
+        user = User.objects.create(username='loner', email='loner@ya.ru')
+        client = APIClient()
+        client.force_authenticate(user)
+        for url in (
+            '/api/users/subscriptions/',
+            '/api/users/subscriptions/?recipes_limit=3',
+        ):
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, url)
+            self.assertEqual(response.data['results'], [])
+
+    def test_subscribe(self):
+        url = f'/api/users/{self.not_followed.pk}/subscribe/'
+        subscriptions = '/api/users/subscriptions/?limit=100'
+        count = self.auth_client.get(subscriptions).data['count']
+        response = self.assertQueries(
+            self.auth_client, 'get', f'{url}?recipes_limit=3',
+            status.HTTP_201_CREATED, 13,
+        )
+        self.assertEqual(response.data['id'], self.not_followed.pk)
+        self.assertTrue(response.data['is_subscribed'])
+        self.assertEqual(len(response.data['recipes']), 3)
+        response = self.auth_client.get(subscriptions)
+        self.assertEqual(response.data['count'], count + 1)
+        self.assertIn(
+            self.not_followed.pk,
+            [author['id'] for author in response.data['results']],
+        )
+        self.assertQueries(
+            self.auth_client, 'delete', url, status.HTTP_204_NO_CONTENT, 7
+        )
@@ -1,6 +1,7 @@
 from django.urls import include, path
 
-from .views import CustomAuthToken, FollowUserView, Logout, subscriptions
+from .views import (CustomAuthToken, FollowUserView, Logout, TokenCacheStats,
+                    subscriptions)
 
 urlpatterns = [
     path(
@@ -11,5 +12,10 @@ urlpatterns = [
     path('users/subscriptions/', subscriptions, name='subscriptions'),
     path('auth/token/login/', CustomAuthToken.as_view(), name='login'),
     path('auth/token/logout/', Logout.as_view(), name='logout'),
+    path(
+        'auth/token/stats/',
+        TokenCacheStats.as_view(),
+        name='token_cache_stats',
+    ),
     path('', include('djoser.urls')),
 ]
@@ -1,14 +1,20 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.decorators import api_view
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.models import Recipe
+from recipes.pagination import ApproximateCountPagination
+
+from .authentication import token_cache
 from .models import Follow
 from .serializers import (AddFollowSerializer, AuthTokenSerializer,
                           SubscribersSerializer)
@@ -16,6 +22,24 @@ from .serializers import (AddFollowSerializer, AuthTokenSerializer,
 User = get_user_model()
 
 
+def prefetch_recipes(authors, request):
+    """
+    Подгружает рецепты авторов одним запросом,
+    с ?recipes_limit= - не больше этого числа на автора
+    """
+    recipes = Recipe.objects.order_by('-pub_date', '-id')
+    limit = request.query_params.get('recipes_limit')
+    if limit is not None:
+        if not limit.isdigit():
+            raise ValidationError(
+                {'recipes_limit': 'Ожидается неотрицательное целое число.'}
+            )
+        recipes = recipes.latest_per_author(
+            [author.pk for author in authors], int(limit)
+        )
+    prefetch_related_objects(authors, Prefetch('recipes', queryset=recipes))
+
+
 class CustomAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
         serializer = AuthTokenSerializer(data=request.data)
@@ -36,6 +60,16 @@ class Logout(APIView):
         )
 
 
+class TokenCacheStats(APIView):
+    """
+    Попадания и промахи кеша токенов в этом процессе
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
 class FollowUserView(APIView):
     """
     Вью создания и удаления подписок.
@@ -55,8 +89,13 @@ class FollowUserView(APIView):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
-        serializer.save()
-        serializer = SubscribersSerializer(user)
+        with transaction.atomic():
+            serializer.save()
+        author = User.objects.with_subscription_info(user).get(pk=pk)
+        prefetch_recipes([author], request)
+        serializer = SubscribersSerializer(
+            author, context={'request': request}
+        )
         return Response(
             serializer.data,
             status=status.HTTP_201_CREATED
@@ -65,21 +104,26 @@ class FollowUserView(APIView):
     def delete(self, request, pk):
         user = request.user
         author = get_object_or_404(User, pk=pk)
-        Follow.objects.filter(user=user, author=author).delete()
+        with transaction.atomic():
+            Follow.objects.filter(user=user, author=author).delete()
         return Response(
             status=status.HTTP_204_NO_CONTENT
         )
 
 
 @api_view(['get'])
+@permission_classes([IsAuthenticated])
 def subscriptions(request):
-    user = User.objects.filter(subscribed_by__user=request.user)
-    paginator = PageNumberPagination()
+    authors = User.objects.with_subscription_info(request.user).filter(
+        subscribed_by__user=request.user
+    )
+    paginator = ApproximateCountPagination()
     paginator.page_size = 10
-    page = paginator.paginate_queryset(user, request)
+    page = paginator.paginate_queryset(authors, request)
+    prefetch_recipes(page, request)
     serializer = SubscribersSerializer(
         page,
         many=True,
-        context={'current_user': request.user}
+        context={'request': request}
     )
     return paginator.get_paginated_response(serializer.data)